@@ -2,10 +2,12 @@ __all__ = [
   'database',
   'messenger',
   'sqlbot',
-  'configuration'
+  'configuration',
+  'metrics'
 ]
 
 from . import database
 from . import messenger
 from . import sqlbot
 from . import configuration
+from . import metrics
@@ -0,0 +1,9 @@
+all = [
+    'fakes.py',
+    'measure.py'
+]
+
+# webhook.py and replay.py are entry points (python -m src.benchmark.<name>),
+# importing them here would make runpy execute them a second time
+from . import fakes
+from . import measure
@@ -0,0 +1,160 @@
+"""
+Offline benchmark of the update handlers
+
+Drives the real handlers with synthetic updates and a FakeBot against the
+database from the given configuration and reports throughput, latency
+percentiles, database round trips and bot API calls per command.
+
+WARNING: the configured database is reset and filled with synthetic users.
+With 'db_backend: sqlite' and 'db_path: ":memory:"' no database server is needed.
+
+    python -m src.benchmark --config bench.yaml --wipe --users 1000 10000
+"""
+
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+
+from .. import metrics
+from .. import database
+from .. import messenger
+from .. import configuration
+from .fakes import FakeBot, message_update
+from .measure import percentile, round_trips, wait_background
+
+
+logger = logging.getLogger('sqlbot.benchmark')
+
+ADMIN_ID = 1
+MOD_IDS  = (2, 3, 4)
+
+# name, command text, sent by the admin, share of the requests per command
+SCENARIOS = [
+    ('start',           "/start",           False, 1.0),
+    ('me',              "/me",              False, 1.0),
+    ('help',            "/help",            False, 1.0),
+    ('setstatus',       "/setstatus bench", False, 1.0),
+    ('forward_message', "hallo",            False, 1.0),
+    ('listusers',       "/listusers",       True,  0.01),
+    ('sendmsg',         "/sendmsg bench",   True,  0.001),
+]
+
+
+async def _seed(db, users: int):
+    await asyncio.to_thread(database.tables.reset_database, db, False)
+    rows = []
+    for chatID in range(1, users + 1):
+        groupID = 3 if chatID == ADMIN_ID else 2 if chatID in MOD_IDS else 1
+        rows.append((chatID, groupID, f"User{chatID}", "Bench" if chatID % 2 else None,
+                     f"user{chatID}" if chatID % 3 else None))
+    if not await database.insert.chats(db, rows):
+        raise RuntimeError("Could not seed the chat table.")
+    database.cache.clear()
+    await database.directory.reload(db)
+    await database.reference.reload(db)
+
+
+async def _scenario(application, bot, users: int, requests: int, concurrency: int,
+                    text: str, as_admin: bool, update_ids):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    baseline  = asyncio.all_tasks()
+
+    async def one():
+        chatID = ADMIN_ID if as_admin else random.randint(len(MOD_IDS) + 2, max(users, len(MOD_IDS) + 2))
+        update = message_update(bot, next(update_ids), chatID, text)
+        async with semaphore:
+            start = time.perf_counter()
+            await application.process_update(update)
+            latencies.append(time.perf_counter() - start)
+
+    trips, calls = round_trips(), sum(bot.calls.values())
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    await wait_background(baseline)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'n':       requests,
+        'rate':    requests / elapsed if elapsed else 0.0,
+        'p50':     percentile(latencies, 0.50) * 1000,
+        'p99':     percentile(latencies, 0.99) * 1000,
+        'db':      (round_trips() - trips) / requests,
+        'api':     (sum(bot.calls.values()) - calls) / requests,
+        'elapsed': elapsed
+    }
+
+
+def _report(users: int, results: dict):
+    print(f"\nusers: {users}")
+    print(f"{'command':<16} {'n':>6} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'db/cmd':>7} {'api/cmd':>8}")
+    for name, res in results.items():
+        print(
+            f"{name:<16} {res['n']:>6} {res['rate']:>9.1f} {res['p50']:>8.2f} {res['p99']:>8.2f} "
+            f"{res['db']:>7.2f} {res['api']:>8.1f}"
+        )
+
+
+async def run(cfg, users: int, requests: int, concurrency: int, latency: float) -> dict:
+    db = database.dbinterface.create(cfg)
+    database.cache.configure(cfg)
+    database.writer.configure(cfg, db)
+    database.tables.migrate(db)
+    await _seed(db, users)
+
+    bot = FakeBot(latency)
+    application = messenger.bot.configure_bot(cfg, db, bot)
+    # started, so tasks of Application.create_task are tracked
+    await application.initialize()
+    await application.start()
+
+    update_ids = iter(range(1, 10 ** 9))
+    results = {}
+    try:
+        for name, text, as_admin, share in SCENARIOS:
+            results[name] = await _scenario(
+                application, bot, users, max(1, int(requests * share)), concurrency,
+                text, as_admin, update_ids
+            )
+    finally:
+        await application.stop()
+        await application.shutdown()
+        db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot handlers offline.")
+    parser.add_argument("--config", type=str, required=True, help="Path to (.yml) config file.")
+    parser.add_argument("--wipe", action="store_true", help="Confirm that the configured database is reset.")
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 1000, 10000], help="Registered chats.")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per command.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Updates processed in parallel.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated bot API latency in seconds.")
+    args = parser.parse_args()
+
+    if not args.wipe:
+        print("The benchmark resets the configured database, confirm with --wipe.")
+        sys.exit(1)
+
+    cfg = configuration.getcfg(args.config)
+    configuration.check_cfg(cfg)
+    logging.basicConfig(level=logging.WARNING, format=cfg.logfmt, datefmt=cfg.ascfmt)
+
+    # the fake bot has no rate limits, do not throttle the broadcast
+    cfg.telegram_rate_global = 1e9
+    cfg.telegram_rate_chat   = 1e9
+    # the synthetic users send far more than a person would
+    cfg.rate_limits          = {}
+    cfg.overload_backlog     = 0
+    metrics.enabled = True
+
+    for users in args.users:
+        _report(users, asyncio.run(run(cfg, users, args.requests, args.concurrency, args.latency)))
+
+
+if __name__ == "__main__":
+    main()
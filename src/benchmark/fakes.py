@@ -0,0 +1,72 @@
+"""
+Offline stand-ins for Telegram: a bot that records API calls instead of
+sending them and factories for synthetic updates
+"""
+
+import time
+import asyncio
+import itertools
+import collections
+
+from telegram import Update
+from telegram.ext import ExtBot
+
+
+class FakeBot(ExtBot):
+    """
+    Bot whose API calls never leave the process.
+    Every call is counted per endpoint and answered with a minimal valid
+    response after an optional simulated latency.
+    """
+    def __init__(self, latency: float = 0.0):
+        super().__init__(token="123456:fake-token")
+        # telegram objects are frozen after __init__
+        with self._unfrozen():
+            self.latency      = latency
+            self.calls        = collections.Counter()
+            self._message_ids = itertools.count(1)
+
+    async def _do_post(self, endpoint: str, data: dict, *args, **kwargs):
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if endpoint == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "SqlBot", "username": "sqlbot_fake"}
+        if endpoint in ("sendMessage", "sendDocument", "editMessageText", "editMessageReplyMarkup"):
+            return {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": data.get("chat_id", 0), "type": "private"},
+                "text": data.get("text", "")
+            }
+        return True
+
+
+def user_dict(chatID: int) -> dict:
+    return {
+        "id": chatID,
+        "is_bot": False,
+        "first_name": f"User{chatID}",
+        "last_name": "Bench" if chatID % 2 else None,
+        "username": f"user{chatID}" if chatID % 3 else None
+    }
+
+
+def message_dict(update_id: int, chatID: int, text: str) -> dict:
+    """update as sent by Telegram: private chat message, texts starting with '/' are a command"""
+    user = {k: v for k, v in user_dict(chatID).items() if v is not None}
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chatID, "type": "private", "first_name": user["first_name"]},
+        "from": user,
+        "text": text
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def message_update(bot: ExtBot, update_id: int, chatID: int, text: str) -> Update:
+    return Update.de_json(message_dict(update_id, chatID, text), bot)
@@ -0,0 +1,28 @@
+"""
+Measurement helpers shared by the benchmark and the replay
+"""
+
+import asyncio
+
+from .. import metrics
+
+
+def round_trips() -> int:
+    """database round trips so far, needs metrics.enabled"""
+    return sum(entry[-1] for entry in metrics.db_query_seconds.values.values())
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def wait_background(baseline: set):
+    """wait for all tasks started since 'baseline', e.g. broadcasts of the handlers"""
+    while True:
+        pending = asyncio.all_tasks() - baseline - {asyncio.current_task()}
+        if not pending:
+            return
+        await asyncio.wait(pending)
@@ -0,0 +1,213 @@
+"""
+Replay of recorded updates (see 'record_updates')
+
+Feeds a recording through the handlers from configure_bot with a FakeBot,
+keeping the recorded arrival times at the given speed, and reports
+throughput, latency percentiles and errors per command. The latency of an
+update is measured from its due time, so falling behind the recording
+shows up as latency.
+
+WARNING: the configured database is reset and filled with the recorded chats.
+
+    python -m src.benchmark.replay --config bench.yaml --wipe --speed 4 --admin 42 updates.jsonl
+"""
+
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import collections
+
+from telegram import Update
+
+from .. import metrics
+from .. import database
+from .. import messenger
+from .. import configuration
+from .fakes import FakeBot
+from .measure import percentile, round_trips, wait_background
+
+
+logger = logging.getLogger('sqlbot.benchmark.replay')
+
+
+def read_recording(path: str):
+    """(unix time, update dict) per recorded update"""
+    with open(path, 'r', encoding='UTF-8') as fp:
+        for num, line in enumerate(fp, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                yield entry["t"], entry["u"]
+            except (ValueError, KeyError) as err:
+                # the last line of a recording cut off by a crash
+                logger.warning(f"Skipping line {num} of '{path}': {err}")
+
+
+def recorded_chats(path: str, bot: FakeBot) -> dict:
+    """chatID -> (firstname, lastname, username) of all chats in the recording"""
+    chats = {}
+    for _, data in read_recording(path):
+        update = Update.de_json(data, bot)
+        chat, user = update.effective_chat, update.effective_user
+        if chat is None or chat.id in chats:
+            continue
+        profile = user if user is not None else chat
+        chats[chat.id] = (profile.first_name or str(chat.id), profile.last_name, profile.username)
+    return chats
+
+
+async def _seed(db, chats: dict, admins: set, mods: set):
+    await asyncio.to_thread(database.tables.reset_database, db, False)
+    rows = [
+        (chatID, 3 if chatID in admins else 2 if chatID in mods else 1, *profile)
+        for chatID, profile in chats.items()
+    ]
+    if rows and not await database.insert.chats(db, rows):
+        raise RuntimeError("Could not seed the chat table.")
+    database.cache.clear()
+    await database.directory.reload(db)
+    await database.reference.reload(db)
+
+
+async def replay(application, bot: FakeBot, path: str, speed: float, max_gap: float, max_pending: int) -> dict:
+    """
+    speed 0 replays as fast as the handlers allow, gaps between updates
+    longer than max_gap seconds (e.g. bot restarts) are shortened to it
+    """
+    latencies = collections.defaultdict(list)
+    errors    = collections.Counter()
+    pending   = asyncio.Semaphore(max_pending)
+    processor = application.update_processor
+    baseline  = asyncio.all_tasks()
+    tasks     = set()
+
+    async def count_error(update: object, _):
+        name = messenger.bot._command_name(update) if isinstance(update, Update) else None
+        errors[name or 'other'] += 1
+
+    application.add_error_handler(count_error)
+
+    async def one(update: Update, due: float):
+        try:
+            await processor.process_update(update, application.process_update(update))
+        finally:
+            pending.release()
+        latencies[messenger.bot._command_name(update) or 'other'].append(time.perf_counter() - due)
+
+    trips, calls = round_trips(), sum(bot.calls.values())
+    start, offset, last, lag = time.perf_counter(), 0.0, None, 0.0
+    for t, data in read_recording(path):
+        if last is not None:
+            offset += min(max(t - last, 0.0), max_gap)
+        last = t
+
+        due = start + offset / speed if speed else time.perf_counter()
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await pending.acquire()
+        lag = max(lag, time.perf_counter() - due)
+
+        task = asyncio.create_task(one(Update.de_json(data, bot), due))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.wait(tasks)
+    await wait_background(baseline)
+    elapsed = time.perf_counter() - start
+
+    total = sum(len(values) for values in latencies.values())
+    return {
+        'n':        total,
+        'elapsed':  elapsed,
+        'recorded': offset,
+        'rate':     total / elapsed if elapsed else 0.0,
+        'lag':      lag,
+        'db':       (round_trips() - trips) / total if total else 0.0,
+        'api':      (sum(bot.calls.values()) - calls) / total if total else 0.0,
+        'commands': {name: values for name, values in sorted(latencies.items())},
+        'errors':   errors
+    }
+
+
+def _report(res: dict):
+    everything = [value for values in res['commands'].values() for value in values]
+    print(f"\n{res['n']} updates in {res['elapsed']:.1f}s (recorded {res['recorded']:.1f}s), "
+          f"{res['rate']:.1f} updates/s, max. lag {res['lag'] * 1000:.1f}ms, "
+          f"{res['db']:.2f} db/update, {res['api']:.2f} api/update")
+    print(f"{'command':<16} {'n':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>7}")
+    for name, values in [*res['commands'].items(), ('all', everything)]:
+        failed = sum(res['errors'].values()) if name == 'all' else res['errors'][name]
+        print(
+            f"{name:<16} {len(values):>6} {percentile(values, 0.50) * 1000:>8.2f} "
+            f"{percentile(values, 0.90) * 1000:>8.2f} {percentile(values, 0.99) * 1000:>8.2f} "
+            f"{max(values, default=0.0) * 1000:>8.2f} {failed:>7}"
+        )
+
+
+async def run(cfg, path: str, speed: float, max_gap: float, max_pending: int,
+              latency: float, admins: set, mods: set) -> dict:
+    db = database.dbinterface.create(cfg)
+    database.cache.configure(cfg)
+    database.writer.configure(cfg, db)
+    database.tables.migrate(db)
+
+    bot = FakeBot(latency)
+    await _seed(db, await asyncio.to_thread(recorded_chats, path, bot), admins, mods)
+
+    application = messenger.bot.configure_bot(cfg, db, bot)
+    # started, so tasks of Application.create_task are tracked; the update
+    # queue stays empty, the replay hands the updates to the processor itself
+    await application.initialize()
+    await application.start()
+    try:
+        return await replay(application, bot, path, speed, max_gap, max_pending)
+    finally:
+        await application.stop()
+        await application.shutdown()
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded updates through the bot handlers offline.")
+    parser.add_argument("--config", type=str, required=True, help="Path to (.yml) config file.")
+    parser.add_argument("--wipe", action="store_true", help="Confirm that the configured database is reset.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed, 0 for as fast as possible.")
+    parser.add_argument("--max-gap", type=float, default=10.0, help="Longest pause between updates in seconds.")
+    parser.add_argument("--max-pending", type=int, default=1000, help="Updates in flight before the replay waits.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated bot API latency in seconds.")
+    parser.add_argument("--admin", type=int, action="append", default=[], help="Recorded chat id seeded as admin.")
+    parser.add_argument("--mod", type=int, action="append", default=[], help="Recorded chat id seeded as moderator.")
+    parser.add_argument("recording", help="File written by 'record_updates'.")
+    args = parser.parse_args()
+
+    if not args.wipe:
+        print("The replay resets the configured database, confirm with --wipe.")
+        sys.exit(1)
+    if args.speed < 0 or args.max_gap < 0 or args.max_pending < 1:
+        print("--speed and --max-gap must not be negative, --max-pending has to be positive.")
+        sys.exit(1)
+
+    cfg = configuration.getcfg(args.config)
+    configuration.check_cfg(cfg)
+    logging.basicConfig(level=logging.WARNING, format=cfg.logfmt, datefmt=cfg.ascfmt)
+
+    # the fake bot has no rate limits, do not throttle the broadcast
+    cfg.telegram_rate_global = 1e9
+    cfg.telegram_rate_chat   = 1e9
+    # never record the replay itself; rate limits and overload shedding stay
+    # active, they are part of how the bot handles the recorded load
+    cfg.record_updates       = None
+    metrics.enabled = True
+
+    _report(asyncio.run(run(cfg, args.recording, args.speed, args.max_gap, args.max_pending,
+                            args.latency, set(args.admin), set(args.mod))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Local test sender for the webhook mode
+
+POSTs synthetic updates to the webhook receiver of a running bot the way
+Telegram does, including the secret token header, and reports the
+response codes and latencies.
+
+    python -m src.benchmark.webhook --config config.yaml --chat 42 --count 100 /start
+
+The handlers answer with real bot API calls, use a chat id which talks to
+the bot or expect 'chat not found' errors in the bot log.
+"""
+
+import sys
+import time
+import random
+import asyncio
+import argparse
+import collections
+
+import httpx
+
+from .. import configuration
+from ..messenger.webhook import SECRET_HEADER
+from .fakes import message_dict
+
+
+async def send(url: str, secret: str, chatIDs: list, texts: list, count: int, concurrency: int) -> dict:
+    headers   = {SECRET_HEADER: secret} if secret else {}
+    statuses  = collections.Counter()
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    # unique per run, Telegram never repeats an update_id either
+    first_id  = int(time.time() * 1000) % 10 ** 9
+
+    async with httpx.AsyncClient(timeout=10.0) as client:
+        async def one(i: int):
+            update = message_dict(first_id + i, random.choice(chatIDs), texts[i % len(texts)])
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    res = await client.post(url, json=update, headers=headers)
+                    statuses[res.status_code] += 1
+                except httpx.HTTPError as err:
+                    statuses[type(err).__name__] += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(count)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'statuses': dict(statuses),
+        'rate':     count / elapsed if elapsed else 0.0,
+        'p50':      latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+        'p99':      latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] * 1000 if latencies else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send synthetic updates to the local webhook receiver.")
+    parser.add_argument("--config", type=str, required=True, help="Path to (.yml) config file.")
+    parser.add_argument("--url", type=str, default=None, help="Receiver URL, defaults to the configured one.")
+    parser.add_argument("--chat", type=int, nargs="+", default=[1], help="Chat ids the updates come from.")
+    parser.add_argument("--count", type=int, default=1, help="Number of updates.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight.")
+    parser.add_argument("text", nargs="+", help="Message texts, sent round robin.")
+    args = parser.parse_args()
+
+    cfg = configuration.getcfg(args.config)
+    configuration.check_cfg(cfg)
+    if not cfg.webhook_enabled:
+        print("Warning: 'webhook_enabled' is not set in the configuration.", file=sys.stderr)
+    url = args.url or f"http://{cfg.webhook_listen}:{cfg.webhook_port}{cfg.webhook_path}"
+
+    res = asyncio.run(send(url, cfg.webhook_secret, args.chat, args.text, args.count, args.concurrency))
+    print(f"{url}: {args.count} updates, {res['rate']:.1f} req/s, "
+          f"p50 {res['p50']:.2f}ms, p99 {res['p99']:.2f}ms")
+    for status, n in sorted(res['statuses'].items(), key=str):
+        print(f"  {status}: {n}")
+
+
+if __name__ == "__main__":
+    main()
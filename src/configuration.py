@@ -6,6 +6,7 @@ from commandline inputs and a YAML file are provided
 """
 
 import os
+import re
 import sys
 import yaml
 import logging
@@ -68,8 +69,24 @@ def getcfg(filename: str = None):
             required=True,
             help="Path to (.yml) config file."
         )
+        transfer = parser.add_mutually_exclusive_group()
+        transfer.add_argument(
+            "--export-chats",
+            type=str,
+            metavar="CSV",
+            help="Export the chat table to a CSV file and exit."
+        )
+        transfer.add_argument(
+            "--import-chats",
+            type=str,
+            metavar="CSV",
+            help="Insert or update the chats of a CSV file and exit."
+        )
         configargs = parser.parse_args()
         filename = configargs.config
+        export_chats, import_chats = configargs.export_chats, configargs.import_chats
+    else:
+        export_chats, import_chats = None, None
 
     if not os.path.isfile(filename):
         logger.critical("Config file not found. Exiting.")
@@ -81,6 +98,8 @@ def getcfg(filename: str = None):
         cfg = Config(cfg_dict)
 
     cfg['configuration_path'] = filename
+    cfg['export_chats']       = export_chats
+    cfg['import_chats']       = import_chats
     return cfg
 
 
@@ -140,6 +159,171 @@ def check_cfg_optional(cfg: Config):
             logger.critical("'db_init' not a bool. Exiting.")
             sys.exit(1)
 
+    cfg['db_backend'] = cfg.get('db_backend', 'postgres')
+    cfg['db_path']    = str(cfg.get('db_path', ':memory:'))
+    if cfg.db_backend not in ('postgres', 'sqlite'):
+        logger.critical("'db_backend' neither 'postgres' nor 'sqlite'. Exiting.")
+        sys.exit(1)
+
+    cfg['db_listen'] = cfg.get('db_listen', False)
+    if not isinstance(cfg.db_listen, bool):
+        logger.critical("'db_listen' not a bool. Exiting.")
+        sys.exit(1)
+
+    cfg['db_pool_min']     = cfg.get('db_pool_min', 1)
+    cfg['db_pool_max']     = cfg.get('db_pool_max', 10)
+    cfg['db_pool_timeout'] = cfg.get('db_pool_timeout', 10)
+    for attr in ['db_pool_min', 'db_pool_max']:
+        if not isinstance(cfg[attr], int) or isinstance(cfg[attr], bool) or cfg[attr] < 1:
+            logger.critical(f"'{attr}' not a positive integer. Exiting.")
+            sys.exit(1)
+    if cfg.db_pool_min > cfg.db_pool_max:
+        logger.critical("'db_pool_min' greater than 'db_pool_max'. Exiting.")
+        sys.exit(1)
+    if not isinstance(cfg.db_pool_timeout, (int, float)) or cfg.db_pool_timeout <= 0:
+        logger.critical("'db_pool_timeout' not a positive number. Exiting.")
+        sys.exit(1)
+
+    cfg['db_group_commit']     = cfg.get('db_group_commit', 0)
+    cfg['db_group_commit_max'] = cfg.get('db_group_commit_max', 100)
+    if not isinstance(cfg.db_group_commit, (int, float)) or cfg.db_group_commit < 0:
+        logger.critical("'db_group_commit' not a non-negative number. Exiting.")
+        sys.exit(1)
+    if not isinstance(cfg.db_group_commit_max, int) or cfg.db_group_commit_max < 1:
+        logger.critical("'db_group_commit_max' not a positive integer. Exiting.")
+        sys.exit(1)
+
+    cfg['concurrent_updates'] = cfg.get('concurrent_updates', 1)
+    if not isinstance(cfg.concurrent_updates, int) or isinstance(cfg.concurrent_updates, bool) \
+            or cfg.concurrent_updates < 1:
+        logger.critical("'concurrent_updates' not a positive integer. Exiting.")
+        sys.exit(1)
+    if cfg.concurrent_updates > cfg.db_pool_max:
+        logger.warning("'concurrent_updates' exceeds 'db_pool_max', handlers will wait for connections.")
+
+    cfg['profile_cache_size']   = cfg.get('profile_cache_size', 10000)
+    cfg['profile_write_behind'] = cfg.get('profile_write_behind', 0)
+    if not isinstance(cfg.profile_cache_size, int) or cfg.profile_cache_size < 0:
+        logger.critical("'profile_cache_size' not a non-negative integer. Exiting.")
+        sys.exit(1)
+    if not isinstance(cfg.profile_write_behind, (int, float)) or cfg.profile_write_behind < 0:
+        logger.critical("'profile_write_behind' not a non-negative number. Exiting.")
+        sys.exit(1)
+
+    cfg['chat_cache_size'] = cfg.get('chat_cache_size', 10000)
+    cfg['chat_cache_ttl']  = cfg.get('chat_cache_ttl', 60)
+    if not isinstance(cfg.chat_cache_size, int) or cfg.chat_cache_size < 0:
+        logger.critical("'chat_cache_size' not a non-negative integer. Exiting.")
+        sys.exit(1)
+    if not isinstance(cfg.chat_cache_ttl, (int, float)) or cfg.chat_cache_ttl < 0:
+        logger.critical("'chat_cache_ttl' not a non-negative number. Exiting.")
+        sys.exit(1)
+
+    cfg['telegram_rate_global']  = cfg.get('telegram_rate_global', 25)
+    cfg['telegram_rate_chat']    = cfg.get('telegram_rate_chat', 1)
+    cfg['broadcast_concurrency'] = cfg.get('broadcast_concurrency', 20)
+    for attr in ['telegram_rate_global', 'telegram_rate_chat']:
+        if not isinstance(cfg[attr], (int, float)) or cfg[attr] <= 0:
+            logger.critical(f"'{attr}' not a positive number. Exiting.")
+            sys.exit(1)
+    if not isinstance(cfg.broadcast_concurrency, int) or cfg.broadcast_concurrency < 1:
+        logger.critical("'broadcast_concurrency' not a positive integer. Exiting.")
+        sys.exit(1)
+
+    cfg['mod_digest_window'] = cfg.get('mod_digest_window', 0)
+    if not isinstance(cfg.mod_digest_window, (int, float)) or cfg.mod_digest_window < 0:
+        logger.critical("'mod_digest_window' not a non-negative number. Exiting.")
+        sys.exit(1)
+
+    cfg['rate_limits'] = cfg.get('rate_limits', {})
+    cfg['rate_limit_group_factor'] = cfg.get('rate_limit_group_factor', {2: 4, 3: 0})
+    cfg['overload_backlog']        = cfg.get('overload_backlog', 200)
+    for name, limit in (cfg.rate_limits or {}).items():
+        if not isinstance(limit, (list, tuple)) or len(limit) != 2 \
+                or not all(isinstance(x, (int, float)) and x > 0 for x in limit):
+            logger.critical(f"'rate_limits.{name}' not a list of a positive rate and burst. Exiting.")
+            sys.exit(1)
+    for level, factor in (cfg.rate_limit_group_factor or {}).items():
+        if not isinstance(level, int) or not isinstance(factor, (int, float)) or factor < 0:
+            logger.critical("'rate_limit_group_factor' not a mapping of groupIDs to non-negative numbers. Exiting.")
+            sys.exit(1)
+    if not isinstance(cfg.overload_backlog, int) or cfg.overload_backlog < 0:
+        logger.critical("'overload_backlog' not a non-negative integer. Exiting.")
+        sys.exit(1)
+
+    cfg['listusers_page_size'] = cfg.get('listusers_page_size', 50)
+    if not isinstance(cfg.listusers_page_size, int) or cfg.listusers_page_size < 1:
+        logger.critical("'listusers_page_size' not a positive integer. Exiting.")
+        sys.exit(1)
+
+    cfg['sandbox_connections']       = cfg.get('sandbox_connections', 2)
+    cfg['sandbox_per_chat']          = cfg.get('sandbox_per_chat', 1)
+    cfg['sandbox_statement_timeout'] = cfg.get('sandbox_statement_timeout', 5000)
+    cfg['sandbox_work_mem']          = str(cfg.get('sandbox_work_mem', '1MB'))
+    cfg['sandbox_temp_file_limit']   = cfg.get('sandbox_temp_file_limit', None)
+    for attr in ['sandbox_connections', 'sandbox_per_chat', 'sandbox_statement_timeout']:
+        if not isinstance(cfg[attr], int) or cfg[attr] < 1:
+            logger.critical(f"'{attr}' not a positive integer. Exiting.")
+            sys.exit(1)
+
+    cfg['metrics_enabled']      = cfg.get('metrics_enabled', False)
+    cfg['metrics_host']         = str(cfg.get('metrics_host', '127.0.0.1'))
+    cfg['metrics_port']         = cfg.get('metrics_port', 9464)
+    cfg['metrics_log_interval'] = cfg.get('metrics_log_interval', 300)
+    if not isinstance(cfg.metrics_enabled, bool):
+        logger.critical("'metrics_enabled' not a bool. Exiting.")
+        sys.exit(1)
+    if not isinstance(cfg.metrics_port, int) or not 0 < cfg.metrics_port < 65536:
+        logger.critical("'metrics_port' not a valid port. Exiting.")
+        sys.exit(1)
+    if not isinstance(cfg.metrics_log_interval, (int, float)) or cfg.metrics_log_interval < 0:
+        logger.critical("'metrics_log_interval' not a non-negative number. Exiting.")
+        sys.exit(1)
+
+    cfg['webhook_enabled']         = cfg.get('webhook_enabled', False)
+    cfg['webhook_listen']          = str(cfg.get('webhook_listen', '127.0.0.1'))
+    cfg['webhook_port']            = cfg.get('webhook_port', 8443)
+    cfg['webhook_path']            = str(cfg.get('webhook_path', '/telegram'))
+    cfg['webhook_secret']          = cfg.get('webhook_secret', None)
+    cfg['webhook_url']             = cfg.get('webhook_url', None)
+    cfg['webhook_max_connections'] = cfg.get('webhook_max_connections', 40)
+    if not isinstance(cfg.webhook_enabled, bool):
+        logger.critical("'webhook_enabled' not a bool. Exiting.")
+        sys.exit(1)
+    if not isinstance(cfg.webhook_port, int) or not 0 < cfg.webhook_port < 65536:
+        logger.critical("'webhook_port' not a valid port. Exiting.")
+        sys.exit(1)
+    if not cfg.webhook_path.startswith('/'):
+        logger.critical("'webhook_path' does not start with '/'. Exiting.")
+        sys.exit(1)
+    if cfg.webhook_secret is not None and \
+            not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", str(cfg.webhook_secret)):
+        logger.critical("'webhook_secret' not 1-256 characters of A-Z, a-z, 0-9, _ and -. Exiting.")
+        sys.exit(1)
+    if not isinstance(cfg.webhook_max_connections, int) or not 1 <= cfg.webhook_max_connections <= 100:
+        logger.critical("'webhook_max_connections' not an integer between 1 and 100. Exiting.")
+        sys.exit(1)
+    if cfg.webhook_enabled and cfg.webhook_secret is None:
+        logger.warning("'webhook_secret' not set, the webhook accepts updates from anyone.")
+
+    cfg['slow_query_threshold']      = cfg.get('slow_query_threshold', 200)
+    cfg['slow_query_explain_sample'] = cfg.get('slow_query_explain_sample', 0.0)
+    cfg['slow_query_log_size']       = cfg.get('slow_query_log_size', 100)
+    if not isinstance(cfg.slow_query_threshold, (int, float)) or cfg.slow_query_threshold < 0:
+        logger.critical("'slow_query_threshold' not a non-negative number. Exiting.")
+        sys.exit(1)
+    if not isinstance(cfg.slow_query_explain_sample, (int, float)) or not 0 <= cfg.slow_query_explain_sample <= 1:
+        logger.critical("'slow_query_explain_sample' not a number between 0 and 1. Exiting.")
+        sys.exit(1)
+    if not isinstance(cfg.slow_query_log_size, int) or cfg.slow_query_log_size < 1:
+        logger.critical("'slow_query_log_size' not a positive integer. Exiting.")
+        sys.exit(1)
+
+    cfg['record_updates'] = cfg.get('record_updates', None)
+    if cfg.record_updates is not None and (not isinstance(cfg.record_updates, str) or not cfg.record_updates):
+        logger.critical("'record_updates' not a file path. Exiting.")
+        sys.exit(1)
+
 
 def check_cfg(cfg: Config):
     """
@@ -3,7 +3,13 @@ all = [
     'update.py',
     'insert.py',
     'tables.py',
-    'dbinterface.py'
+    'dbinterface.py',
+    'cache.py',
+    'directory.py',
+    'listener.py',
+    'reference.py',
+    'writer.py',
+    'transfer.py'
 ]
 
 from . import get
@@ -11,3 +17,9 @@ from . import update
 from . import insert
 from . import tables
 from . import dbinterface
+from . import cache
+from . import directory
+from . import listener
+from . import reference
+from . import writer
+from . import transfer
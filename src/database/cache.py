@@ -0,0 +1,211 @@
+"""
+In-process caches shared by the database modules and the handlers
+"""
+
+import time
+import asyncio
+from collections import OrderedDict
+
+
+# sentinel to tell a cached None apart from a missing entry
+MISSING = object()
+
+
+class LRUCache():
+    """
+    Bounded mapping which evicts the least recently used entry
+    once more than maxsize entries are stored.
+    """
+    def __init__(self, maxsize: int):
+        self._data   = OrderedDict()
+        self.maxsize = maxsize
+        self.hits    = 0
+        self.misses  = 0
+
+    def get(self, key, default=None):
+        if key in self._data:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+        self.misses += 1
+        return default
+
+    def peek(self, key, default=None):
+        """get without counting a hit or miss and without refreshing the entry"""
+        return self._data.get(key, default)
+
+    def put(self, key, val):
+        self._data[key] = val
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+    def resize(self, maxsize: int):
+        self.maxsize = maxsize
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TTLCache(LRUCache):
+    """
+    LRUCache whose entries expire 'ttl' seconds after they were stored.
+
+    version(key) changes with every invalidation of that key or of the
+    whole cache. Read-through callers take it before querying and pass it
+    to put, so a result fetched while the entry was invalidated is not
+    stored, while invalidations of other keys do not matter.
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize)
+        self.ttl    = ttl
+        # generations per invalidated key, keys without one are at _floor
+        self._clock = 0
+        self._floor = 0
+        self._gens  = {}
+
+    def version(self, key) -> int:
+        return self._gens.get(key, self._floor)
+
+    def _invalidate(self, key):
+        self._clock += 1
+        self._gens[key] = self._clock
+        if len(self._gens) > 2 * self.maxsize:
+            # raising every key to the newest generation keeps the dict bounded,
+            # only fills which are in flight right now are dropped
+            self._floor = self._clock
+            self._gens.clear()
+
+    def get(self, key, default=None):
+        entry = super().get(key, MISSING)
+        if entry is MISSING:
+            return default
+        expires, val = entry
+        if expires < time.monotonic():
+            self._data.pop(key, None)
+            self.hits   -= 1
+            self.misses += 1
+            return default
+        return val
+
+    def peek(self, key, default=None):
+        entry = super().peek(key, MISSING)
+        if entry is MISSING or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+
+    def put(self, key, val, version: int = None) -> bool:
+        if version is not None and version != self.version(key):
+            return False
+        super().put(key, (time.monotonic() + self.ttl, val))
+        return True
+
+    def replace(self, key, val, version: int) -> bool:
+        """
+        put for writers: stores the row they just wrote, or drops the entry
+        if the key was invalidated meanwhile, and invalidates the fills of
+        readers which may have read the row before the write
+        """
+        stored = self.put(key, val, version)
+        if not stored:
+            super().pop(key, None)
+        self._invalidate(key)
+        return stored
+
+    def pop(self, key, default=None):
+        self._invalidate(key)
+        entry = super().pop(key, MISSING)
+        return default if entry is MISSING else entry[1]
+
+    def clear(self):
+        self._clock += 1
+        self._floor  = self._clock
+        self._gens.clear()
+        super().clear()
+
+
+class SingleFlight():
+    """
+    Runs at most one call of the coroutine function func at a time.
+    Callers arriving while it runs share a single rerun started after it,
+    which reads everything changed before they called.
+    """
+    def __init__(self, func):
+        self._func    = func
+        self._running = None
+        self._rerun   = None
+        self._timer   = None
+        self._tasks   = set()
+
+    @property
+    def pending(self) -> bool:
+        """a rerun is waiting for the running call"""
+        return self._rerun is not None
+
+    async def _start(self, previous, *args):
+        if previous is not None:
+            await asyncio.wait([previous])
+        self._running = asyncio.current_task()
+        if self._rerun is self._running:
+            self._rerun = None
+        try:
+            return await self._func(*args)
+        finally:
+            if self._running is asyncio.current_task():
+                self._running = None
+
+    async def __call__(self, *args):
+        if self._rerun is None:
+            self._rerun = asyncio.ensure_future(self._start(self._running, *args))
+        # a cancelled caller must not cancel the call the others share
+        return await asyncio.shield(self._rerun)
+
+    def later(self, delay: float, *args):
+        """
+        Call once 'delay' seconds from now without waiting for it, further
+        calls of later until then are coalesced into that call.
+        """
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(delay, self._fire, args)
+
+    def _fire(self, args):
+        self._timer = None
+        task = asyncio.ensure_future(self(*args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+# chatID -> (firstname, lastname, username) as last written to the chat table
+profiles = LRUCache(10000)
+
+# chatID -> chat_info row, None for chats that are not registered
+chat_infos = TTLCache(10000, 60.0)
+
+
+def configure(cfg):
+    profiles.resize(cfg.profile_cache_size)
+    chat_infos.resize(cfg.chat_cache_size)
+    chat_infos.ttl = cfg.chat_cache_ttl
+
+
+def clear():
+    profiles.clear()
+    chat_infos.clear()
+
+
+def stats() -> dict:
+    return {
+        name: {'size': len(c), 'hits': c.hits, 'misses': c.misses}
+        for name, c in (('profiles', profiles), ('chat_infos', chat_infos))
+    }
@@ -1,12 +1,142 @@
 import sys
+import time
+import random
+import sqlite3
+import asyncio
 import logging
+import datetime
+import functools
+import threading
+import contextlib
+import collections
+import concurrent.futures
 import psycopg2
+import psycopg2.pool
+import psycopg2.extensions
+
+from .. import metrics
 
 
 class DBInterface():
+    """
+    Storage contract of the bot, implemented by PostgresInterface and
+    SQLiteInterface.
+
+    Every call of execute/fetch runs in its own transaction which is
+    committed on success and rolled back on failure. The blocking *_sync
+    methods are meant for startup code, handlers use the awaitable
+    variants which run the query in a worker thread so the event loop
+    keeps serving other chats while the database is busy.
+
+    Queries are written with %s placeholders and translated by the backend.
+    Statements which differ between the backends are selected by 'dialect'.
+    """
+    dialect        = None
+    explain_prefix = None
+    # DB-API exception base class of the backend
+    Error          = Exception
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Hold a connection for the duration of the with-block.
+        The transaction is committed when the block finishes and rolled back
+        if it raises.
+        """
+        raise NotImplementedError
+
+    @contextlib.contextmanager
+    def cursor(self):
+        with self.connection() as conn, contextlib.closing(conn.cursor()) as cur:
+            yield cur
+
+    def translate(self, query: str) -> str:
+        return query
+
+    def _run(self, fetch: bool, query, params=None):
+        label = metrics.query_label(query) if metrics.enabled else None
+        start = time.perf_counter()
+        try:
+            with self.cursor() as cur:
+                cur.execute(self.translate(query), params or ())
+                res  = cur.fetchall() if fetch else True
+                rows = cur.rowcount
+        except self.Error as err:
+            self._logger.error("Could not execute SQL-Query.", exc_info=err)
+            metrics.db_query_errors.inc(label)
+            return None if fetch else False
+        finally:
+            duration = time.perf_counter() - start
+            metrics.db_query_seconds.observe(duration, label)
+            self.slow_queries.check(query, params, duration)
+        metrics.db_query_rows.inc(label, amount=max(rows, 0))
+        return res
+
+    def _transact(self, func, *args):
+        label = func.__qualname__ if metrics.enabled else None
+        start = time.perf_counter()
+        try:
+            with self.cursor() as cur:
+                return func(cur, *args)
+        except self.Error as err:
+            self._logger.error("Could not execute transaction.", exc_info=err)
+            metrics.db_query_errors.inc(label)
+            return None
+        finally:
+            metrics.db_query_seconds.observe(time.perf_counter() - start, label)
+
+    def execute_sync(self, query, params=None) -> bool:
+        return self._run(False, query, params)
+
+    def fetch_sync(self, query, params=None):
+        return self._run(True, query, params)
+
+    async def execute(self, query, params=None) -> bool:
+        return await asyncio.to_thread(self._run, False, query, params)
+
+    async def fetch(self, query, params=None):
+        return await asyncio.to_thread(self._run, True, query, params)
+
+    async def transaction(self, func, *args):
+        """
+        Run func(cursor, *args) in a worker thread within one transaction.
+        func receives a cursor of the backend and has to translate its
+        queries itself. Returns the result of func or None if it failed.
+        """
+        return await asyncio.to_thread(self._transact, func, *args)
+
+    def close(self):
+        if hasattr(self, "sandbox"):
+            self.sandbox.close()
+        if hasattr(self, "slow_queries"):
+            self.slow_queries.close()
+
+    def __init__(self, cfg):
+        self._logger      = logging.getLogger('sqlbot.dbinterface')
+        self.slow_queries = SlowQueryLog(cfg, self)
+
+    def __del__(self):
+        self.close()
+        self._logger.info("Database connection closed.")
+
+
+class PostgresInterface(DBInterface):
+    """
+    Pool of postgres connections, every operation checks out its own
+    connection.
+    """
+    dialect        = "postgres"
+    explain_prefix = "EXPLAIN (ANALYZE, BUFFERS) "
+    Error          = psycopg2.Error
+
+    # connections idle for longer than this are pinged before being handed out
+    _PING_AFTER = 30.0
+
     def _connect(self):
         try:
-            self._conn = psycopg2.connect(
+            self._pool = psycopg2.pool.ThreadedConnectionPool(
+                self._pool_min,
+                self._pool_max,
                 database=self._db_name,
                 user=self._db_user,
                 password=self._db_password,
@@ -16,63 +146,435 @@ class DBInterface():
         except psycopg2.Error as err:
             self._logger.critical("Can not connect to postgres.", exc_info=err)
             sys.exit(1)
-        self._cur = self._conn.cursor()
-        self._logger.info("Database connection established.")
+        self._logger.info(f"Database connection pool established ({self._pool_min}-{self._pool_max}).")
 
-    def _check_connection(self):
-        if hasattr(self, "_conn"):
-            i = self._conn.closed
+    def _healthy(self, conn) -> bool:
+        if conn.closed != 0:
+            return False
+        try:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                return False
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if time.monotonic() - self._last_used.get(id(conn), 0.0) < self._PING_AFTER:
+                return True
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        if not self._slots.acquire(timeout=self._pool_timeout):
+            raise psycopg2.pool.PoolError(f"No database connection available within {self._pool_timeout}s.")
+        try:
+            # replace dead members, at most once per pool slot
+            for _ in range(self._pool_max):
+                conn = self._pool.getconn()
+                if self._healthy(conn):
+                    self._pids[id(conn)] = conn.info.backend_pid
+                    return conn
+                self._logger.warning("Discarding broken database connection.")
+                self._last_used.pop(id(conn), None)
+                self._pids.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+            raise psycopg2.pool.PoolError("Could not obtain a healthy database connection.")
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _checkin(self, conn):
+        broken = conn.closed != 0
+        if broken:
+            self._last_used.pop(id(conn), None)
+            self._pids.pop(id(conn), None)
         else:
-            i = -1
-        if i != 0:
-            self._connect()
-        return i
+            self._last_used[id(conn)] = time.monotonic()
+        self._pool.putconn(conn, close=broken)
+        self._slots.release()
+
+    def backend_pids(self) -> set:
+        """server process ids of the pooled connections, tells own notifications apart"""
+        return set(self._pids.values())
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self._checkout()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            if conn.closed == 0:
+                conn.rollback()
+            raise
+        finally:
+            self._checkin(conn)
+
+    def close(self):
+        if hasattr(self, "_pool") and not self._pool.closed:
+            self._pool.closeall()
+        super().close()
+
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.sandbox       = PostgresSandboxLane(cfg, self.slow_queries)
+        self._db_name      = cfg.db_name
+        self._db_user      = cfg.db_user
+        self._db_password  = cfg.db_password
+        self._db_host      = cfg.db_host
+        self._db_port      = cfg.db_port
+        self._pool_min     = cfg.db_pool_min
+        self._pool_max     = cfg.db_pool_max
+        self._pool_timeout = cfg.db_pool_timeout
+        self._slots        = threading.BoundedSemaphore(self._pool_max)
+        self._last_used    = {}
+        self._pids         = {}
+        self._connect()
+
+
+class SQLiteInterface(DBInterface):
+    """
+    Embedded database in a file or in memory (db_path ':memory:').
+    One connection is shared by all operations and used by one thread at
+    a time, SQLite serializes writes anyway.
+    """
+    dialect        = "sqlite"
+    explain_prefix = "EXPLAIN QUERY PLAN "
+    Error          = sqlite3.Error
+
+    @staticmethod
+    @functools.lru_cache(maxsize=512)
+    def _translate(query: str) -> str:
+        return query.replace("%s", "?").replace("%%", "%")
+
+    def translate(self, query: str) -> str:
+        return self._translate(query)
+
+    def _open(self):
+        if self.in_memory:
+            target, uri = f"file:sqlbot-{id(self)}?mode=memory&cache=shared", True
+        else:
+            target, uri = self._db_path, False
+        conn = sqlite3.connect(target, uri=uri, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA foreign_keys = ON;")
+        if not self.in_memory:
+            conn.execute("PRAGMA journal_mode = WAL;")
+            conn.execute("PRAGMA busy_timeout = 5000;")
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        with self.lock:
+            self._conn.execute("BEGIN;")
+            try:
+                yield self._conn
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def close(self):
+        if hasattr(self, "_conn"):
+            self._conn.close()
+        super().close()
+
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self._db_path  = cfg.db_path
+        self.in_memory = cfg.db_path == ":memory:"
+        # one transaction at a time, shared with the sandbox lane for :memory:
+        self.lock      = threading.Lock()
+        try:
+            self._conn = self._open()
+        except sqlite3.Error as err:
+            self._logger.critical(f"Can not open sqlite database '{self._db_path}'.", exc_info=err)
+            sys.exit(1)
+        self.sandbox = SQLiteSandboxLane(cfg, self)
+        self._logger.info(f"SQLite database '{self._db_path}' opened.")
+
+
+def create(cfg) -> DBInterface:
+    """storage backend selected by 'db_backend'"""
+    if cfg.db_backend == "sqlite":
+        return SQLiteInterface(cfg)
+    return PostgresInterface(cfg)
+
+
+class SlowQuery():
+    def __init__(self, query: str, params: tuple, duration: float, handler: str):
+        self.time     = datetime.datetime.now()
+        self.query    = " ".join(str(query).split())
+        self.params   = params
+        self.duration = duration
+        self.handler  = handler
+        self.plan     = None
+
+    def format(self) -> str:
+        res = (
+            f"{self.time:%H:%M:%S} {self.duration * 1000:.0f}ms [{self.handler or '-'}]\n"
+            f"{self.query}"
+        )
+        if self.params:
+            res += f"\nparams: {', '.join(self.params)}"
+        if self.plan:
+            res += f"\n{self.plan}"
+        return res
 
-    def execute(self, *args, **kwargs):
-        self._check_connection()
+
+class SlowQueryLog():
+    """
+    Ring buffer of statements slower than slow_query_threshold milliseconds.
+
+    Parameters are only recorded by type. For a sampled fraction of the
+    slow statements the backend's EXPLAIN is run in a background thread
+    inside a transaction which is rolled back afterwards.
+    """
+    def __init__(self, cfg, db: DBInterface):
+        self._logger    = logging.getLogger('sqlbot.dbinterface.slowlog')
+        self._db        = db
+        self._threshold = cfg.slow_query_threshold / 1000
+        self._sample    = cfg.slow_query_explain_sample
+        self._entries   = collections.deque(maxlen=cfg.slow_query_log_size)
+        self._explainer = None
+
+    @staticmethod
+    def _redact(params) -> tuple:
+        if params is None:
+            return ()
+        if isinstance(params, dict):
+            return tuple(f"{key}=<{type(val).__name__}>" for key, val in params.items())
+        return tuple(f"<{type(val).__name__}>" for val in params)
+
+    def check(self, query, params, duration: float, explain: bool = True):
+        if self._threshold <= 0 or duration < self._threshold:
+            return
+        entry = SlowQuery(query, self._redact(params), duration, metrics.current_handler.get())
+        self._entries.append(entry)
+        self._logger.warning(f"Slow query ({duration * 1000:.0f}ms): {entry.query[:200]}")
+
+        if explain and self._sample > 0 and random.random() < self._sample:
+            if self._explainer is None:
+                self._explainer = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="explain")
+            self._explainer.submit(self._explain, entry, query, params)
+
+    def _explain(self, entry: SlowQuery, query, params):
         try:
-            self._cur.execute(*args, **kwargs)
+            with self._db.connection() as conn, contextlib.closing(conn.cursor()) as cur:
+                cur.execute(self._db.translate(self._db.explain_prefix + query), params or ())
+                entry.plan = "\n".join(str(row[-1]) for row in cur.fetchall())
+                # EXPLAIN ANALYZE executes the statement, undo its effects
+                conn.rollback()
+        except self._db.Error as err:
+            self._logger.debug("Could not explain slow query.", exc_info=err)
+
+    def entries(self, limit: int = None) -> list:
+        entries = list(self._entries)[::-1]
+        return entries[:limit] if limit else entries
+
+    def close(self):
+        if self._explainer is not None:
+            self._explainer.shutdown(wait=False, cancel_futures=True)
+
+
+class SandboxLane():
+    """
+    Separate, limited execution lane for statements built from user input.
+
+    Statements still running after the deadline or whose awaiting task
+    gets cancelled are cancelled in the database. Each chat may only run
+    a limited number of statements at once, so an injected sleep or
+    cartesian join can not exhaust the connections the other handlers use.
+    Backends implement _checkout, _checkin, _execute and _cancel.
+    """
+    Error = Exception
+
+    def __init__(self, cfg, slow_queries: SlowQueryLog):
+        self._logger    = logging.getLogger('sqlbot.dbinterface.sandbox')
+        self._slow      = slow_queries
+        self._per_chat  = cfg.sandbox_per_chat
+        self._timeout   = cfg.sandbox_statement_timeout / 1000
+        self._deadline  = self._timeout + 1.0
+        self._slots     = asyncio.Semaphore(cfg.sandbox_connections)
+        self._running   = {}
+
+    def running(self) -> int:
+        return sum(self._running.values())
+
+    def busy(self, chatID: int) -> bool:
+        return self._running.get(chatID, 0) >= self._per_chat
+
+    def _run(self, conn, query, params=None) -> bool:
+        start = time.perf_counter()
+        try:
+            self._execute(conn, query, params)
             return True
-        except psycopg2.Error as err:
+        except self.Error as err:
             self._logger.error("Could not execute SQL-Query.", exc_info=err)
-            self.rollback()
+            metrics.db_query_errors.inc("sandbox")
             return False
+        finally:
+            duration = time.perf_counter() - start
+            metrics.db_query_seconds.observe(duration, "sandbox")
+            # user built statements are neither redacted nor explained
+            self._slow.check(query, params, duration, explain=False)
 
-    def fetchall(self):
-        self._check_connection()
+    async def execute(self, chatID: int, query, params=None) -> bool:
+        if self.busy(chatID):
+            self._logger.warning(f"Chat '{chatID}' exceeds its concurrent sandbox statements.")
+            return False
+
+        self._running[chatID] = self._running.get(chatID, 0) + 1
         try:
-            return self._cur.fetchall()
-        except psycopg2.Error as err:
-            self.rollback()
-            self._logger.error("Could not fetch.", exc_info=err)
-            return None
+            async with self._slots:
+                try:
+                    conn = await asyncio.to_thread(self._checkout)
+                except self.Error as err:
+                    self._logger.error("No sandbox connection available.", exc_info=err)
+                    return False
+                task = asyncio.ensure_future(asyncio.to_thread(self._run, conn, query, params))
+                try:
+                    return await asyncio.wait_for(asyncio.shield(task), self._deadline)
+                except asyncio.TimeoutError:
+                    self._logger.warning(f"Sandbox statement of chat '{chatID}' exceeded its deadline.")
+                    self._cancel(conn)
+                    await asyncio.wait([task])
+                    return False
+                except asyncio.CancelledError:
+                    self._cancel(conn)
+                    await asyncio.wait([task])
+                    raise
+                finally:
+                    await asyncio.to_thread(self._checkin, conn)
+        finally:
+            self._running[chatID] -= 1
+            if not self._running[chatID]:
+                del self._running[chatID]
+
+    def close(self):
+        pass
 
-    def rollback(self):
-        if self._check_connection() != 0:
-            self._logger.error("Database connection unexpectetly closed.")
-        self._conn.rollback()
 
-    def commit(self):
-        if self._check_connection() != 0:
-            self._logger.error("Database connection unexpectetly closed. Data may be lost.")
-            self.rollback()
-            return False
-        self._conn.commit()
-        return True
+class PostgresSandboxLane(SandboxLane):
+    """
+    Own connections opened with their own statement_timeout, work_mem and
+    (optionally) temp_file_limit, cancelled on the server.
+    """
+    Error = psycopg2.Error
+
+    def __init__(self, cfg, slow_queries: SlowQueryLog):
+        super().__init__(cfg, slow_queries)
+        options = f"-c statement_timeout={cfg.sandbox_statement_timeout} -c work_mem={cfg.sandbox_work_mem}"
+        if cfg.sandbox_temp_file_limit:
+            options += f" -c temp_file_limit={cfg.sandbox_temp_file_limit}"
+        self._pool = psycopg2.pool.ThreadedConnectionPool(
+            0,
+            cfg.sandbox_connections,
+            database=cfg.db_name,
+            user=cfg.db_user,
+            password=cfg.db_password,
+            host=cfg.db_host,
+            port=cfg.db_port,
+            options=options
+        )
+
+    def _checkout(self):
+        conn = self._pool.getconn()
+        if conn.closed != 0:
+            self._pool.putconn(conn, close=True)
+            conn = self._pool.getconn()
+        conn.autocommit = True
+        return conn
+
+    def _checkin(self, conn):
+        # undo session settings an injected SET may have left behind
+        try:
+            if conn.closed == 0:
+                with conn.cursor() as cur:
+                    cur.execute("DISCARD ALL;")
+        except psycopg2.Error:
+            conn.close()
+        self._pool.putconn(conn, close=conn.closed != 0)
+
+    def _execute(self, conn, query, params=None):
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+
+    def _cancel(self, conn):
+        conn.cancel()
 
     def close(self):
-        if hasattr(self, "_conn") and self._conn.closed == 0:
-            self._conn.close()
+        if not self._pool.closed:
+            self._pool.closeall()
 
-    def __init__(self, cfg):
-        self._logger      = logging.getLogger('sqlbot.dbinterface')
-        self._db_name     = cfg.db_name
-        self._db_user     = cfg.db_user
-        self._db_password = cfg.db_password
-        self._db_host     = cfg.db_host
-        self._db_port     = cfg.db_port
-        self._connect()
 
-    def __del__(self):
-        self.close()
-        self._logger.info("Database connection closed.")
+class _SQLiteStatement():
+    """state of one sandbox statement, stands in for the connection"""
+    def __init__(self):
+        self.cancelled = False
+        self.running   = False
+
+
+class SQLiteSandboxLane(SandboxLane):
+    """
+    File databases get an own connection with a limited string length,
+    in-memory databases share the main connection. The statement timeout
+    is enforced by a progress handler, stacked statements are executed as
+    a script like postgres does.
+    The connection lock is only held within the worker thread executing the
+    statement, never across awaits, so queued queries of the other handlers
+    can not starve the executor.
+    """
+    Error = sqlite3.Error
+
+    # longest string or blob a statement may build
+    _MAX_LENGTH = 1000000
+
+    def __init__(self, cfg, db: SQLiteInterface):
+        super().__init__(cfg, db.slow_queries)
+        self._db         = db
+        self._state_lock = threading.Lock()
+        if db.in_memory:
+            self._conn, self._lock = db._conn, db.lock
+        else:
+            self._conn, self._lock = db._open(), threading.Lock()
+            self._conn.setlimit(sqlite3.SQLITE_LIMIT_LENGTH, self._MAX_LENGTH)
+
+    def _checkout(self):
+        return _SQLiteStatement()
+
+    def _checkin(self, stmt: _SQLiteStatement):
+        pass
+
+    def _execute(self, stmt: _SQLiteStatement, query, params=None):
+        with self._lock:
+            with self._state_lock:
+                if stmt.cancelled:
+                    raise sqlite3.OperationalError("interrupted")
+                stmt.running = True
+            deadline = time.monotonic() + self._timeout
+            self._conn.set_progress_handler(lambda: stmt.cancelled or time.monotonic() > deadline, 10000)
+            try:
+                if params:
+                    self._conn.execute(self._db.translate(query), params)
+                else:
+                    self._conn.executescript(query)
+            finally:
+                with self._state_lock:
+                    stmt.running = False
+                self._conn.set_progress_handler(None, 0)
+                if self._conn.in_transaction:
+                    self._conn.rollback()
+
+    def _cancel(self, stmt: _SQLiteStatement):
+        with self._state_lock:
+            stmt.cancelled = True
+            # interrupt() hits whatever runs on the connection, only
+            # while this statement does
+            if stmt.running:
+                self._conn.interrupt()
+
+    def close(self):
+        if self._conn is not self._db._conn:
+            self._conn.close()
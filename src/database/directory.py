@@ -0,0 +1,132 @@
+"""
+In-memory directory of the chat ids per groupID
+
+Loaded at startup and kept current by the database modules that insert
+chats or change their group, so the fan-out to moderators does not need a
+query per message. Ids are stored as sorted arrays of 64 bit integers.
+"""
+
+import bisect
+import logging
+from array import array
+
+from . import cache
+
+
+logger = logging.getLogger("sqlbot.database.directory")
+
+
+class GroupDirectory():
+    def __init__(self):
+        self._groups = {}
+        self.loaded  = False
+        # bumped on every change, a load of rows read before a change is discarded
+        self.version = 0
+
+    def load(self, rows, version: int = None) -> bool:
+        """rows: iterable of (chatID, groupID)"""
+        if version is not None and version != self.version:
+            return False
+        groups = {}
+        for chatID, groupID in rows:
+            groups.setdefault(groupID, []).append(chatID)
+        self._groups = {groupID: array('q', sorted(ids)) for groupID, ids in groups.items()}
+        self.loaded  = True
+        return True
+
+    def invalidate(self):
+        self._groups  = {}
+        self.loaded   = False
+        self.version += 1
+
+    def group_of(self, chatID: int):
+        for groupID, ids in self._groups.items():
+            i = bisect.bisect_left(ids, chatID)
+            if i < len(ids) and ids[i] == chatID:
+                return groupID
+        return None
+
+    def remove(self, chatID: int):
+        for ids in self._groups.values():
+            i = bisect.bisect_left(ids, chatID)
+            if i < len(ids) and ids[i] == chatID:
+                del ids[i]
+                return
+
+    def drop(self, chatID: int):
+        self.version += 1
+        self.remove(chatID)
+
+    def set(self, chatID: int, groupID: int):
+        self.version += 1
+        if not self.loaded:
+            return
+        self.remove(chatID)
+        ids = self._groups.setdefault(groupID, array('q'))
+        ids.insert(bisect.bisect_left(ids, chatID), chatID)
+
+    def at_least(self, groupID: int) -> list:
+        """chat ids of all groups >= groupID"""
+        res = []
+        for gid, ids in self._groups.items():
+            if gid >= groupID:
+                res.extend(ids)
+        return res
+
+    def stats(self) -> dict:
+        return {groupID: len(ids) for groupID, ids in sorted(self._groups.items())}
+
+
+groups = GroupDirectory()
+
+_SQL = "SELECT chatid, groupid FROM chat;"
+
+
+def load(db) -> bool:
+    """blocking, for startup code and worker threads"""
+    rows = db.fetch_sync(_SQL)
+    if rows is None:
+        groups.invalidate()
+        logger.error("Could not load the group directory, falling back to queries.")
+        return False
+    groups.load(rows)
+    logger.info(f"Group directory loaded: {groups.stats()}")
+    return True
+
+
+async def _reload(db, attempts: int) -> bool:
+    for _ in range(attempts):
+        version = groups.version
+        rows    = await db.fetch(_SQL)
+        if rows is None:
+            break
+        if groups.load(rows, version):
+            return True
+        if _flight.pending:
+            # changed meanwhile, the queued rerun reads the newer rows
+            return False
+    # rows served by mark_stale are outdated
+    groups.invalidate()
+    logger.error("Could not reload the group directory, falling back to queries.")
+    return False
+
+
+_flight = cache.SingleFlight(_reload)
+
+
+def mark_stale(db, delay: float = 1.0):
+    """
+    Like reload, but the current rows are served until a single reload
+    'delay' seconds from now, which covers all changes marked until then.
+    """
+    _flight.later(delay, db, 3)
+
+
+async def reload(db, attempts: int = 3) -> bool:
+    """
+    Reload after statements which may have changed any row. Until the
+    directory is loaded again lookups fall back to queries. Concurrent
+    reloads are coalesced into one running and one queued reload.
+    """
+    groups.invalidate()
+    return await _flight(db, attempts)
@@ -1,50 +1,99 @@
 import logging
 
+from . import cache
+from . import directory
+from . import reference
 from .dbinterface import DBInterface
 
 
 logger = logging.getLogger("sqlbot.database.get")
 
 
-def chat_known(db: DBInterface, chatID: int) -> bool:
-    sql_str = "SELECT count(*) FROM chat WHERE chatID = %s;"
-    db.execute(sql_str, (chatID,))
-    return bool(db.fetchall()[0][0])
+async def chat_known(db: DBInterface, chatID: int) -> bool:
+    return await chat_info(db, chatID) is not None
 
 
-def chat_info(db: DBInterface, chatID: int):
+async def chat_info(db: DBInterface, chatID: int):
+    res = cache.chat_infos.get(chatID, cache.MISSING)
+    if res is not cache.MISSING:
+        return res
+
     sql_str = """
         SELECT c.firstname, c.lastname, u.groupid, u.description, c.status
         FROM chat c INNER JOIN usergroup u on u.groupid = c.groupid
         WHERE chatid = %s;
     """
-    db.execute(sql_str, (chatID,))
-    res = db.fetchall()
+    version = cache.chat_infos.version(chatID)
+    res = await db.fetch(sql_str, (chatID,))
 
     logger.debug(f"chat_info(...): {res}")
 
-    if isinstance(res, list) and len(res) > 0:
-        return res[0]
-    return None
+    if not isinstance(res, list):
+        return None
+    res = res[0] if len(res) > 0 else None
+    cache.chat_infos.put(chatID, res, version)
+    return res
 
 
-def groups(db: DBInterface):
+async def groups(db: DBInterface):
+    if reference.usergroups is not None:
+        return list(reference.usergroups)
     sql_str = "SELECT * FROM usergroup ORDER BY groupid;"
-    db.execute(sql_str)
-    return db.fetchall()
+    return await db.fetch(sql_str) or []
 
 
-def chatids_with_groupid(db: DBInterface, groupid: int):
+async def chatids_with_groupid(db: DBInterface, groupid: int):
+    if directory.groups.loaded:
+        return directory.groups.at_least(groupid)
     sql_str = "SELECT chatid FROM chat WHERE groupid >= %s;"
-    db.execute(sql_str, (groupid,))
-    return list(map(lambda x: x[0], db.fetchall()))
+    return list(map(lambda x: x[0], await db.fetch(sql_str, (groupid,)) or []))
 
 
-def chats(db: DBInterface):
-    sql_str = """
-        SELECT chatid, groupid, firstname, lastname, username
-        FROM chat
-        ORDER BY groupid;
+def chat_selection(chatIDs: list = (), ranges: list = (), groupid: int = None) -> tuple:
+    """
+    WHERE condition selecting chats by id, by (first, last) id range or by
+    group, as (sql, params).
+    """
+    parts, params = [], []
+    if chatIDs:
+        parts.append("chatid IN ({})".format(", ".join(["%s"] * len(chatIDs))))
+        params.extend(chatIDs)
+    for first, last in ranges:
+        parts.append("chatid BETWEEN %s AND %s")
+        params.extend((first, last))
+    if groupid is not None:
+        parts.append("groupid = %s")
+        params.append(groupid)
+    return " OR ".join(parts) or "FALSE", params
+
+
+async def chat_groups(db: DBInterface, chatIDs: list = (), ranges: list = (), groupid: int = None):
+    """(chatid, groupid) of the selected chats, None if the query failed"""
+    where, params = chat_selection(chatIDs, ranges, groupid)
+    sql_str = f"SELECT chatid, groupid FROM chat WHERE {where};"
+    return await db.fetch(sql_str, params)
+
+
+async def chats_page(db: DBInterface, after: tuple = None, limit: int = 50):
+    """
+    Keyset pagination over the user listing.
+    after: (groupid, chatid) of the last row of the previous page
     """
-    db.execute(sql_str)
-    return db.fetchall()
+    if after is None:
+        sql_str = """
+            SELECT chatid, groupid, firstname, lastname, username
+            FROM chat
+            ORDER BY groupid, chatid
+            LIMIT %s;
+        """
+        params = (limit,)
+    else:
+        sql_str = """
+            SELECT chatid, groupid, firstname, lastname, username
+            FROM chat
+            WHERE (groupid, chatid) > (%s, %s)
+            ORDER BY groupid, chatid
+            LIMIT %s;
+        """
+        params = (after[0], after[1], limit)
+    return await db.fetch(sql_str, params)
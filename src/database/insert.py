@@ -1,10 +1,21 @@
+from . import cache
+from . import directory
+from . import tables
 from .dbinterface import DBInterface
 
 
-def chat(db: DBInterface, chatID: int, firstname: str, lastname: str, username: str):
-    sql_str = """
-        INSERT INTO chat (chatID, groupID, firstname, lastname, username)
-        VALUES (%s, 0, %s, %s, %s);
-    """
-    if db.execute(sql_str, (chatID, firstname, lastname, username)):
-        db.commit()
+async def chats(db: DBInterface, rows: list, batch_size: int = 1000) -> bool:
+    """rows: list of (chatID, groupID, firstname, lastname, username) tuples"""
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+        sql_str = """
+            INSERT INTO chat (chatID, groupID, firstname, lastname, username)
+            VALUES {};
+        """.format(", ".join(["(%s, %s, %s, %s, %s)"] * len(batch)))
+        if not await db.execute(sql_str, [val for row in batch for val in row]):
+            return False
+        for row in batch:
+            directory.groups.set(row[0], row[1])
+            tables.update_snapshot(row[0], row[1], row[2:], register=True)
+    cache.chat_infos.clear()
+    return True
@@ -0,0 +1,170 @@
+"""
+Cross-instance cache invalidation
+
+Triggers on chat and usergroup (migration 5) NOTIFY the 'sqlbot_changes'
+channel. The listener keeps one extra connection LISTENing on it inside the
+event loop and applies targeted invalidations to the caches and the group
+directory, so changes by other bot processes or by hand in psql are picked
+up immediately. Postgres only.
+"""
+
+import json
+import asyncio
+import logging
+import psycopg2
+import psycopg2.extensions
+
+from . import cache
+from . import directory
+from . import reference
+from .dbinterface import DBInterface
+
+
+logger = logging.getLogger("sqlbot.database.listener")
+
+CHANNEL = "sqlbot_changes"
+
+
+class ChangeListener():
+    # seconds between reconnection attempts, doubled up to the maximum
+    _RETRY_MIN = 1.0
+    _RETRY_MAX = 60.0
+
+    def __init__(self, cfg, db: DBInterface):
+        self._cfg      = cfg
+        self._db       = db
+        self._conn     = None
+        self._task     = None
+        self._tasks    = set()
+        self.connected = False
+        self.received  = 0
+
+    def _connect(self):
+        conn = psycopg2.connect(
+            database=self._cfg.db_name,
+            user=self._cfg.db_user,
+            password=self._cfg.db_password,
+            host=self._cfg.db_host,
+            port=self._cfg.db_port
+        )
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {CHANNEL};")
+        return conn
+
+    def _apply(self, notify):
+        self.received += 1
+        try:
+            payload = json.loads(notify.payload)
+        except ValueError:
+            logger.warning(f"Invalid change notification: {notify.payload[:200]}")
+            payload = {'table': None, 'rows': None}
+
+        if payload.get('table') == 'chat' and payload.get('rows') is not None:
+            # own writes update the caches themselves
+            if notify.pid in self._db.backend_pids():
+                return
+            for chatID, groupID in payload['rows']:
+                cache.chat_infos.pop(chatID)
+                cache.profiles.pop(chatID)
+                if groupID is None:
+                    directory.groups.drop(chatID)
+                else:
+                    directory.groups.set(chatID, groupID)
+        elif payload.get('table') == 'usergroup':
+            # the descriptions are part of the cached chat_info rows
+            cache.chat_infos.clear()
+            self._spawn(reference.reload(self._db))
+        else:
+            self._invalidate_all()
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _invalidate_all(self):
+        cache.clear()
+        self._spawn(directory.reload(self._db))
+        self._spawn(reference.reload(self._db))
+
+    def _on_readable(self, stopped: asyncio.Future):
+        try:
+            self._conn.poll()
+        except psycopg2.Error as err:
+            if not stopped.done():
+                stopped.set_exception(err)
+            return
+        while self._conn.notifies:
+            self._apply(self._conn.notifies.pop(0))
+
+    async def _run(self):
+        loop      = asyncio.get_running_loop()
+        delay     = self._RETRY_MIN
+        reconnect = False
+        while True:
+            try:
+                self._conn = await asyncio.to_thread(self._connect)
+            except psycopg2.Error as err:
+                logger.warning(f"Could not connect the change listener, retry in {delay:.0f}s: {err}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self._RETRY_MAX)
+                continue
+
+            # notifications sent while disconnected are lost
+            if reconnect:
+                self._invalidate_all()
+            delay, reconnect = self._RETRY_MIN, True
+            self.connected   = True
+            logger.info(f"Listening for changes on channel '{CHANNEL}'.")
+
+            fd      = self._conn.fileno()
+            stopped = loop.create_future()
+            loop.add_reader(fd, self._on_readable, stopped)
+            try:
+                await stopped
+            except psycopg2.Error as err:
+                logger.warning(f"Change listener connection lost: {err}")
+            finally:
+                self.connected = False
+                loop.remove_reader(fd)
+                self._conn.close()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+listener = None
+
+
+def start(cfg, db: DBInterface):
+    global listener
+    if not cfg.db_listen:
+        return
+    if db.dialect != "postgres":
+        logger.warning("'db_listen' needs the postgres backend, ignored.")
+        return
+    listener = ChangeListener(cfg, db)
+    listener.start()
+
+
+def listening() -> bool:
+    """changes of all connections currently reach the caches"""
+    return listener is not None and listener.connected
+
+
+async def stop():
+    global listener
+    if listener is not None:
+        await listener.stop()
+        listener = None
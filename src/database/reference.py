@@ -0,0 +1,59 @@
+"""
+Reference data loaded once and refreshed on change
+
+The usergroup rows only change through migrations, /resetdb, the injectable
+/setstatus statement or by hand, each of which triggers a (delayed) reload.
+"""
+
+import logging
+
+from . import cache
+
+
+logger = logging.getLogger("sqlbot.database.reference")
+
+_SQL = "SELECT groupid, description FROM usergroup ORDER BY groupid;"
+
+# (groupID, description) rows, None while not loaded
+usergroups = None
+
+# bumped on every load, lets renderers cache replies built from the rows
+version = 0
+
+
+def _set(rows):
+    global usergroups, version
+    usergroups = tuple(tuple(row) for row in rows) if rows is not None else None
+    version   += 1
+
+
+def load(db) -> bool:
+    """blocking, for startup code"""
+    rows = db.fetch_sync(_SQL)
+    _set(rows)
+    if rows is None:
+        logger.error("Could not load the usergroups, falling back to queries.")
+        return False
+    return True
+
+
+async def _reload(db) -> bool:
+    rows = await db.fetch(_SQL)
+    _set(rows)
+    if rows is None:
+        logger.error("Could not reload the usergroups, falling back to queries.")
+        return False
+    return True
+
+
+_flight = cache.SingleFlight(_reload)
+
+
+def mark_stale(db, delay: float = 1.0):
+    """the rows are served until a single reload 'delay' seconds from now"""
+    _flight.later(delay, db)
+
+
+async def reload(db) -> bool:
+    """concurrent reloads are coalesced into one running and one queued reload"""
+    return await _flight(db)
@@ -1,74 +1,303 @@
-import sys
+import time
 import logging
+import psycopg2.extras
 from .dbinterface import DBInterface
 
 
 logger = logging.getLogger("sqlbot.database.tables")
 
+# arbitrary key for pg_advisory_xact_lock, keeps concurrently starting bots
+# from applying the same migration twice
+_MIGRATION_LOCK = 0x5a1b07
 
-def drop_all_tables(db: DBInterface):
-    sql_str = """
-        DROP TABLE IF EXISTS chat;
-        DROP TABLE IF EXISTS usergroup;
-    """
-    db.execute(sql_str)
-    db.commit()
+# Ordered schema migrations per dialect: (version, description, sql).
+# Every step has to be idempotent, so databases created before the
+# migrations existed are upgraded without errors. A version number means
+# the same change in both dialects, but some versions exist in one only
+# (sqlite 6); applied migrations are never edited, fixes get a new version.
+MIGRATIONS = {
+    "postgres": [
+        (1, "create table usergroup", """
+            CREATE TABLE IF NOT EXISTS usergroup (
+                groupID SMALLINT CHECK (groupID <= 5 AND groupID >= 0) PRIMARY KEY,
+                description TEXT NOT NULL
+            );
+            INSERT INTO usergroup VALUES
+                (0, 'Gast'),
+                (1, 'Nutzer'),
+                (2, 'Moderator'),
+                (3, 'Admin')
+            ON CONFLICT (groupID) DO NOTHING;
+        """),
+        (2, "create table chat", """
+            CREATE TABLE IF NOT EXISTS chat (
+                chatID    BIGINT PRIMARY KEY,
+                groupID   SMALLINT NOT NULL,
+                firstName TEXT NOT NULL,
+                lastName  TEXT,
+                username  TEXT,
+                status    TEXT,
+                FOREIGN KEY (groupID) REFERENCES usergroup(groupID)
+            );
+        """),
+        (3, "index chat by groupid", """
+            CREATE INDEX IF NOT EXISTS chat_groupid_idx ON chat (groupID) INCLUDE (chatID);
+        """),
+        (4, "covering index for the user listing", """
+            CREATE INDEX IF NOT EXISTS chat_listing_idx ON chat (groupID, chatID)
+            INCLUDE (firstName, lastName, username);
+        """),
+        # one notification per statement: [chatID, groupID] pairs of the changed
+        # rows (groupID null if deleted), or null rows if too many to list
+        (5, "notify listeners about changed chats and usergroups", """
+            CREATE OR REPLACE FUNCTION sqlbot_notify_chat() RETURNS trigger AS $$
+            DECLARE
+                n    BIGINT;
+                rows JSONB;
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    SELECT count(*), jsonb_agg(jsonb_build_array(chatID, groupID)) INTO n, rows
+                    FROM changed;
+                ELSIF TG_OP = 'DELETE' THEN
+                    SELECT count(*), jsonb_agg(jsonb_build_array(chatID, NULL)) INTO n, rows
+                    FROM changed_old;
+                ELSE
+                    SELECT count(*), jsonb_agg(jsonb_build_array(COALESCE(c.chatID, o.chatID), c.groupID))
+                    INTO n, rows
+                    FROM changed c FULL JOIN changed_old o ON o.chatID = c.chatID;
+                END IF;
+                IF n = 0 THEN
+                    RETURN NULL;
+                END IF;
+                IF n > 200 THEN
+                    rows := NULL;
+                END IF;
+                PERFORM pg_notify('sqlbot_changes', jsonb_build_object('table', 'chat', 'rows', rows)::TEXT);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE OR REPLACE FUNCTION sqlbot_notify_table() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('sqlbot_changes', jsonb_build_object('table', TG_TABLE_NAME, 'rows', NULL)::TEXT);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
 
+            DROP TRIGGER IF EXISTS chat_notify_insert ON chat;
+            DROP TRIGGER IF EXISTS chat_notify_update ON chat;
+            DROP TRIGGER IF EXISTS chat_notify_delete ON chat;
+            DROP TRIGGER IF EXISTS chat_notify_truncate ON chat;
+            DROP TRIGGER IF EXISTS usergroup_notify ON usergroup;
+            CREATE TRIGGER chat_notify_insert AFTER INSERT ON chat
+                REFERENCING NEW TABLE AS changed
+                FOR EACH STATEMENT EXECUTE FUNCTION sqlbot_notify_chat();
+            CREATE TRIGGER chat_notify_update AFTER UPDATE ON chat
+                REFERENCING OLD TABLE AS changed_old NEW TABLE AS changed
+                FOR EACH STATEMENT EXECUTE FUNCTION sqlbot_notify_chat();
+            CREATE TRIGGER chat_notify_delete AFTER DELETE ON chat
+                REFERENCING OLD TABLE AS changed_old
+                FOR EACH STATEMENT EXECUTE FUNCTION sqlbot_notify_chat();
+            CREATE TRIGGER chat_notify_truncate AFTER TRUNCATE ON chat
+                FOR EACH STATEMENT EXECUTE FUNCTION sqlbot_notify_table();
+            CREATE TRIGGER usergroup_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON usergroup
+                FOR EACH STATEMENT EXECUTE FUNCTION sqlbot_notify_table();
+        """),
+        # chat_listing_idx (groupID, chatID, ...) serves the lookups by groupid
+        (7, "drop the redundant groupid index", """
+            DROP INDEX IF EXISTS chat_groupid_idx;
+        """),
+    ],
+    "sqlite": [
+        (1, "create table usergroup", """
+            CREATE TABLE IF NOT EXISTS usergroup (
+                groupID INTEGER CHECK (groupID <= 5 AND groupID >= 0) PRIMARY KEY,
+                description TEXT NOT NULL
+            );
+            INSERT INTO usergroup VALUES
+                (0, 'Gast'),
+                (1, 'Nutzer'),
+                (2, 'Moderator'),
+                (3, 'Admin')
+            ON CONFLICT (groupID) DO NOTHING;
+        """),
+        (2, "create table chat", """
+            CREATE TABLE IF NOT EXISTS chat (
+                chatID    INTEGER PRIMARY KEY,
+                groupID   INTEGER NOT NULL,
+                firstName TEXT NOT NULL,
+                lastName  TEXT,
+                username  TEXT,
+                status    TEXT,
+                FOREIGN KEY (groupID) REFERENCES usergroup(groupID)
+            );
+        """),
+        # chatID is the rowid, every index on chat already contains it
+        (3, "index chat by groupid", """
+            CREATE INDEX IF NOT EXISTS chat_groupid_idx ON chat (groupID);
+        """),
+        (4, "covering index for the user listing", """
+            CREATE INDEX IF NOT EXISTS chat_listing_idx ON chat (groupID, firstName, lastName, username);
+        """),
+        # the index of 4 does not match the keyset order groupid, chatid
+        (6, "recreate the user listing index in keyset order", """
+            DROP INDEX IF EXISTS chat_listing_idx;
+            CREATE INDEX chat_listing_idx ON chat (groupID, chatID, firstName, lastName, username);
+        """),
+        # chat_listing_idx (groupID, chatID, ...) serves the lookups by groupid
+        (7, "drop the redundant groupid index", """
+            DROP INDEX IF EXISTS chat_groupid_idx;
+        """),
+    ],
+}
 
-def create_table_usergroup(db: DBInterface):
-    sql_str = """
-        CREATE TABLE usergroup (
-            groupID SMALLINT CHECK (groupID <= 5 AND groupID >= 0) PRIMARY KEY,
-            description TEXT NOT NULL
+_SCHEMA_VERSION_SQL = {
+    "postgres": """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version     INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at  TIMESTAMPTZ NOT NULL DEFAULT now()
         );
-    """
-    db.execute(sql_str)
+    """,
+    "sqlite": """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version     INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at  TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    """,
+}
 
-    sql_str = """
-        INSERT INTO usergroup VALUES(0, 'Gast');
-        INSERT INTO usergroup VALUES(1, 'Nutzer');
-        INSERT INTO usergroup VALUES(2, 'Moderator');
-        INSERT INTO usergroup VALUES(3, 'Admin');
+
+def _execute_script(db: DBInterface, cur, sql_str: str):
+    """sqlite cursors only execute one statement at a time"""
+    if db.dialect != "sqlite":
+        cur.execute(sql_str)
+        return
+    for statement in sql_str.split(";"):
+        if statement.strip():
+            cur.execute(statement)
+
+
+def drop_all_tables(db: DBInterface):
+    for table in ("chat", "usergroup", "schema_version"):
+        db.execute_sync(f"DROP TABLE IF EXISTS {table};")
+
+
+def _apply_migrations(db: DBInterface, cur) -> int:
+    cur.execute(_SCHEMA_VERSION_SQL[db.dialect])
+    cur.execute("SELECT version FROM schema_version;")
+    applied = {row[0] for row in cur.fetchall()}
+
+    for version, description, sql_str in MIGRATIONS[db.dialect]:
+        if version in applied:
+            continue
+        _execute_script(db, cur, sql_str)
+        cur.execute(
+            db.translate("INSERT INTO schema_version (version, description) VALUES (%s, %s);"),
+            (version, description)
+        )
+        logger.info(f"Applied migration {version}: {description}")
+        applied.add(version)
+
+    return max(applied, default=0)
+
+
+def migrate(db: DBInterface) -> int:
     """
-    db.execute(sql_str)
-
-
-def create_table_chat(db: DBInterface):
-    sql_str = """
-        CREATE TABLE chat (
-            chatID    BIGINT PRIMARY KEY,
-            groupID   SMALLINT NOT NULL,
-            firstName TEXT NOT NULL,
-            lastName  TEXT,
-            username  TEXT,
-            status    TEXT,
-            FOREIGN KEY (groupID) REFERENCES usergroup(groupID)
-        );
+    Apply all pending migrations in a single transaction.
+    Returns the resulting schema version.
     """
-    db.execute(sql_str)
+    with db.cursor() as cur:
+        if db.dialect == "postgres":
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (_MIGRATION_LOCK,))
+        return _apply_migrations(db, cur)
 
 
-def initialize_database(db: DBInterface):
-    drop_all_tables(db)
+# chatID -> (chatID, groupID, firstName, lastName, username) of the registered
+# users, captured at startup and afterwards only changed through the bot's own
+# write paths (update_snapshot); a reset restores exactly these rows
+snapshot = {}
 
-    create_table_usergroup(db)
-    create_table_chat(db)
+_SNAPSHOT_SQL = {
+    "postgres": """
+        SELECT chatID, LEAST(GREATEST(groupID, 0), 3), firstName, lastName, username
+        FROM chat WHERE firstName IS NOT NULL;
+    """,
+    "sqlite": """
+        SELECT chatID, MIN(MAX(groupID, 0), 3), firstName, lastName, username
+        FROM chat WHERE firstName IS NOT NULL;
+    """,
+}
 
-    db.commit()
+_RESTORE_SQL = "INSERT INTO chat (chatID, groupID, firstName, lastName, username) VALUES %s;"
+
+
+def capture_snapshot(db: DBInterface) -> int:
+    global snapshot
+    rows = db.fetch_sync(_SNAPSHOT_SQL[db.dialect])
+    if rows is not None:
+        snapshot = {row[0]: tuple(row) for row in rows}
+    return len(snapshot)
+
+
+def update_snapshot(chatID: int, groupID: int = None, profile: tuple = None, register: bool = False):
+    """
+    Record a change of the chat table made by the bot itself. Chats not in
+    the snapshot are only added if register is set, as guests unless
+    groupID is given. None keeps the current group or profile.
+    """
+    row = snapshot.get(chatID)
+    if row is None:
+        if not register:
+            return
+        row = (chatID, 0, None, None, None)
+    if groupID is not None:
+        row = (chatID, min(max(groupID, 0), 3), *row[2:])
+    if profile is not None and profile[0] is not None:
+        row = (*row[:2], *profile)
+    if row[2] is not None:
+        snapshot[chatID] = row
 
-    logger.warning("Database (re)initialized.")
 
+def reset_database(db: DBInterface, keep_chats: bool = True, keep_chatIDs: tuple = ()) -> int:
+    """
+    Restore schema and seed data in place within one transaction.
+    Registered users are restored from the snapshot, so rows inserted or
+    changed by demo queries are undone. If keep_chats is False only
+    keep_chatIDs survive. Statuses are cleared.
+    Returns the number of restored users.
+    """
+    global snapshot
+    start = time.monotonic()
+    with db.cursor() as cur:
+        if db.dialect == "postgres":
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (_MIGRATION_LOCK,))
+
+        # a copy, handlers keep updating the snapshot meanwhile
+        chats = dict(snapshot)
+        if not keep_chats:
+            chats = {chatID: row for chatID, row in chats.items() if chatID in keep_chatIDs}
+
+        if db.dialect == "postgres":
+            cur.execute("DROP TABLE IF EXISTS chat, usergroup, schema_version CASCADE;")
+            _apply_migrations(db, cur)
+            psycopg2.extras.execute_values(cur, _RESTORE_SQL, list(chats.values()), page_size=1000)
+            # dropping the tables does not fire the triggers
+            cur.execute("SELECT pg_notify('sqlbot_changes', '{\"table\": \"chat\", \"rows\": null}');")
+        else:
+            for table in ("chat", "usergroup", "schema_version"):
+                cur.execute(f"DROP TABLE IF EXISTS {table};")
+            _apply_migrations(db, cur)
+            cur.executemany(_RESTORE_SQL.replace("%s", "(?, ?, ?, ?, ?)"), list(chats.values()))
 
-def check_table_existance(db: DBInterface):
-    sql_str = "SELECT to_regclass('public.chat');"
-    db.execute(sql_str)
-    table_chat = db.fetchall()[0][0]
+    snapshot = chats
+    logger.warning(f"Database reset in {(time.monotonic() - start) * 1000:.0f}ms, {len(chats)} users restored.")
+    return len(chats)
 
-    sql_str = "SELECT to_regclass('public.usergroup');"
-    db.execute(sql_str)
-    table_usergroup = db.fetchall()[0][0]
 
-    if table_chat is None or table_usergroup is None:
-        logger.critical("Database tables missing. Need to be (re)initialized.")
-        db.close()
-        sys.exit(1)
+def initialize_database(db: DBInterface):
+    drop_all_tables(db)
+    migrate(db)
+
+    logger.warning("Database (re)initialized.")
@@ -0,0 +1,97 @@
+"""
+CSV export and import of the chat table
+
+Postgres streams the rows with COPY, sqlite with a cursor and the csv
+module, so the memory used does not depend on the size of the table.
+An import inserts new chats and updates the existing ones in bulk.
+"""
+
+import csv
+import logging
+
+from . import cache
+from .dbinterface import DBInterface
+
+
+logger = logging.getLogger("sqlbot.database.transfer")
+
+COLUMNS = ("chatid", "groupid", "firstname", "lastname", "username", "status")
+
+_COLUMN_LIST = ", ".join(COLUMNS)
+
+_UPSERT_SET = ", ".join(f"{col} = EXCLUDED.{col}" for col in COLUMNS[1:])
+
+_EXPORT_COPY = f"COPY (SELECT {_COLUMN_LIST} FROM chat ORDER BY chatid) TO STDOUT WITH (FORMAT csv, HEADER);"
+
+_IMPORT_COPY = f"COPY chat_import ({_COLUMN_LIST}) FROM STDIN WITH (FORMAT csv);"
+
+# later rows of the file win if a chatid occurs twice
+_IMPORT_UPSERT_POSTGRES = f"""
+    INSERT INTO chat ({_COLUMN_LIST})
+    SELECT DISTINCT ON (chatid) {_COLUMN_LIST} FROM chat_import ORDER BY chatid, n DESC
+    ON CONFLICT (chatid) DO UPDATE SET {_UPSERT_SET};
+"""
+
+_IMPORT_UPSERT_SQLITE = f"""
+    INSERT INTO chat ({_COLUMN_LIST}) VALUES ({", ".join(["?"] * len(COLUMNS))})
+    ON CONFLICT (chatid) DO UPDATE SET {_UPSERT_SET};
+"""
+
+
+def export_chats(db: DBInterface, fp) -> int:
+    """
+    Write all chats as CSV with a header line to the text file fp.
+    Returns the number of exported chats.
+    """
+    with db.cursor() as cur:
+        if db.dialect == "postgres":
+            cur.copy_expert(_EXPORT_COPY, fp)
+            return cur.rowcount
+
+        # NULL and empty text both become an empty field, as with COPY
+        writer = csv.writer(fp)
+        writer.writerow(COLUMNS)
+        cur.execute(f"SELECT {_COLUMN_LIST} FROM chat ORDER BY chatid;")
+        rows = 0
+        while batch := cur.fetchmany(1000):
+            writer.writerows(batch)
+            rows += len(batch)
+        return rows
+
+
+def _check_header(line: str):
+    header = tuple(col.strip().lower() for col in next(csv.reader([line]), []))
+    if header != COLUMNS:
+        raise ValueError(f"CSV header has to be '{','.join(COLUMNS)}', got '{line.strip()}'")
+
+
+def _sqlite_rows(reader):
+    for row in reader:
+        if len(row) != len(COLUMNS):
+            raise ValueError(f"CSV line {reader.line_num + 1} has {len(row)} instead of {len(COLUMNS)} fields")
+        # empty optional fields are NULL, as COPY reads them
+        yield (int(row[0]), int(row[1]), row[2], *(val or None for val in row[3:]))
+
+
+def import_chats(db: DBInterface, fp) -> int:
+    """
+    Insert or update all chats of the CSV text file fp, as written by
+    export_chats, in one transaction.
+    Returns the number of inserted or updated chats.
+    """
+    _check_header(fp.readline())
+    try:
+        with db.cursor() as cur:
+            if db.dialect == "postgres":
+                cur.execute("""
+                    CREATE TEMP TABLE chat_import (LIKE chat) ON COMMIT DROP;
+                    ALTER TABLE chat_import ADD COLUMN n BIGSERIAL;
+                """)
+                cur.copy_expert(_IMPORT_COPY, fp)
+                cur.execute(_IMPORT_UPSERT_POSTGRES)
+                return cur.rowcount
+
+            cur.executemany(_IMPORT_UPSERT_SQLITE, _sqlite_rows(csv.reader(fp)))
+            return cur.rowcount
+    finally:
+        cache.clear()
@@ -1,34 +1,200 @@
 import logging
 
+from . import get
+from . import cache
+from . import directory
+from . import listener
+from . import reference
+from . import tables
+from . import writer
 from .dbinterface import DBInterface
 
 
 logger = logging.getLogger("sqlbot.database.update")
 
 
-def chat_groupID(db: DBInterface, chatID: int, groupID: int) -> bool:
+async def chat_groupID(db: DBInterface, chatID: int, groupID: int) -> bool:
     sql_str = "UPDATE chat SET groupid = %s WHERE chatid = %s;"
-    return bool(db.execute(sql_str, (groupID, chatID)) and db.commit())
+    res = await writer.execute(db, sql_str, (groupID, chatID))
+    cache.chat_infos.pop(chatID)
+    if res:
+        directory.groups.set(chatID, groupID)
+        tables.update_snapshot(chatID, groupID)
+    return res
 
 
-def chat_status(db: DBInterface, chatID: int, status: str) -> bool:
-    sql_str = "UPDATE chat SET status = %s WHERE chatid = %s;"
-    return bool(db.execute(sql_str, (status, chatID)) and db.commit())
+async def chats_groupID(db: DBInterface, groupID: int, below: int,
+                        chatIDs: list = (), ranges: list = (), groupid: int = None):
+    """
+    Assign groupID to all selected chats (see get.chat_selection) whose
+    current group is lower than 'below', in one statement.
+    Returns the ids of the changed chats or None if the query failed.
+    """
+    where, params = get.chat_selection(chatIDs, ranges, groupid)
+    sql_str = f"""
+        UPDATE chat SET groupid = %s
+        WHERE ({where}) AND groupid < %s AND groupid <> %s
+        RETURNING chatid;
+    """
+    res = await db.fetch(sql_str, [groupID, *params, below, groupID])
+    if res is None:
+        logger.debug("Failed to update the group of several chats.")
+        return None
+    for (chatID,) in res:
+        cache.chat_infos.pop(chatID)
+        directory.groups.set(chatID, groupID)
+        tables.update_snapshot(chatID, groupID)
+    return [row[0] for row in res]
 
 
-def chat_status_bad(db: DBInterface, chatID: int, status: str) -> bool:
+async def chat_status_bad(db: DBInterface, chatID: int, status: str) -> bool:
     sql_str = f"UPDATE chat SET status = '{status}' WHERE chatid = {chatID};"
     logger.info(f"Update users status: {sql_str}")
-    return bool(db.execute(sql_str) and db.commit())
+    res = await db.sandbox.execute(chatID, sql_str)
+    if listener.listening():
+        # the sandbox connection is not ours, the triggers report every row
+        # it changed; only the own row has to be current right away
+        cache.chat_infos.pop(chatID)
+        return res
+    # the injected statement may have modified any row, the directory and
+    # the usergroups are reloaded once for all /setstatus of a second
+    cache.clear()
+    directory.mark_stale(db)
+    reference.mark_stale(db)
+    return res
 
 
-def chat(db: DBInterface, chatID: int, firstname: str, lastname: str, username: str) -> bool:
+async def chat(db: DBInterface, chatID: int, firstname: str, lastname: str, username: str) -> bool:
     sql_str = """
         UPDATE chat SET firstname = %s, lastname = %s, username = %s
         WHERE chatid = %s;
     """
-    if db.execute(sql_str, (firstname, lastname, username, chatID)):
-        return db.commit()
+    res = await writer.execute(db, sql_str, (firstname, lastname, username, chatID))
+    cache.chat_infos.pop(chatID)
+    if res:
+        cache.profiles.put(chatID, (firstname, lastname, username))
+        tables.update_snapshot(chatID, profile=(firstname, lastname, username))
+        return True
     else:
         logger.debug("Failed to update chat.")
         return False
+
+
+async def chats(db: DBInterface, profiles: list) -> bool:
+    """profiles: list of (chatID, firstname, lastname, username) tuples"""
+    if not profiles:
+        return True
+    if db.dialect == "sqlite":
+        res = await db.transaction(_chats_sqlite, db, profiles)
+    else:
+        res = await _chats_postgres(db, profiles)
+    for profile in profiles:
+        cache.chat_infos.pop(profile[0])
+    if res:
+        for chatID, firstname, lastname, username in profiles:
+            cache.profiles.put(chatID, (firstname, lastname, username))
+            tables.update_snapshot(chatID, profile=(firstname, lastname, username))
+        return True
+    logger.debug(f"Failed to update {len(profiles)} chats.")
+    return False
+
+
+def _chats_sqlite(cur, db: DBInterface, profiles: list) -> bool:
+    # statements are not sent over a network, one per profile is cheap
+    sql_str = "UPDATE chat SET firstname = %s, lastname = %s, username = %s WHERE chatid = %s;"
+    cur.executemany(db.translate(sql_str), [(*profile[1:], profile[0]) for profile in profiles])
+    return True
+
+
+async def _chats_postgres(db: DBInterface, profiles: list) -> bool:
+    sql_str = """
+        UPDATE chat SET firstname = v.firstname, lastname = v.lastname, username = v.username
+        FROM (VALUES {}) AS v (chatid, firstname, lastname, username)
+        WHERE chat.chatid = v.chatid;
+    """.format(", ".join(["(%s::BIGINT, %s::TEXT, %s::TEXT, %s::TEXT)"] * len(profiles)))
+    params = [val for profile in profiles for val in profile]
+    return await db.execute(sql_str, params)
+
+
+async def chat_touch(db: DBInterface, chatID: int, firstname: str, lastname: str, username: str,
+                     register: bool = False):
+    """
+    Store the Telegram profile and load the chat_info row in one statement
+    (one transaction on sqlite), committed through the group commit writer.
+    If register is set unknown chats are inserted as guests.
+    Returns (chat_info, inserted), chat_info is None for unknown chats
+    and (None, False) is returned if the query failed.
+    """
+    touch = _chat_touch_sqlite if db.dialect == "sqlite" else _chat_touch_postgres
+    # a group change committed while the touch is in flight discards its row
+    version = cache.chat_infos.version(chatID)
+    res     = await writer.transaction(db, touch, db, chatID, (firstname, lastname, username), register)
+    if res is None:
+        cache.chat_infos.pop(chatID)
+        logger.debug("Failed to touch chat.")
+        return None, False
+
+    cache.profiles.put(chatID, (firstname, lastname, username))
+    if not res:
+        cache.chat_infos.replace(chatID, None, version)
+        return None, False
+    info, inserted = tuple(res[0][:5]), bool(res[0][5])
+    cache.chat_infos.replace(chatID, info, version)
+    if inserted:
+        directory.groups.set(chatID, info[2])
+    # a chat the snapshot already knows keeps its group when registered again
+    tables.update_snapshot(chatID, profile=(firstname, lastname, username), register=inserted)
+    return info, inserted
+
+
+def _chat_touch_sqlite(cur, db: DBInterface, chatID: int, profile: tuple, register: bool) -> list:
+    # RETURNING can not be joined in sqlite, three statements in one transaction instead
+    cur.execute(db.translate("SELECT 1 FROM chat WHERE chatid = %s;"), (chatID,))
+    known = cur.fetchone() is not None
+    if known:
+        cur.execute(
+            db.translate("UPDATE chat SET firstname = %s, lastname = %s, username = %s WHERE chatid = %s;"),
+            (*profile, chatID)
+        )
+    elif register:
+        cur.execute(
+            db.translate("INSERT INTO chat (chatID, groupID, firstname, lastname, username) VALUES (%s, 0, %s, %s, %s);"),
+            (chatID, *profile)
+        )
+    else:
+        return []
+    cur.execute(db.translate("""
+        SELECT c.firstname, c.lastname, u.groupid, u.description, c.status, %s
+        FROM chat c INNER JOIN usergroup u on u.groupid = c.groupid
+        WHERE chatid = %s;
+    """), (not known, chatID))
+    return cur.fetchall()
+
+
+def _chat_touch_postgres(cur, db: DBInterface, chatID: int, profile: tuple, register: bool) -> list:
+    if register:
+        sql_str = """
+            WITH c AS (
+                INSERT INTO chat (chatID, groupID, firstname, lastname, username)
+                VALUES (%s, 0, %s, %s, %s)
+                ON CONFLICT (chatID) DO UPDATE
+                SET firstname = EXCLUDED.firstname, lastname = EXCLUDED.lastname, username = EXCLUDED.username
+                RETURNING firstname, lastname, groupid, status, (xmax = 0) AS inserted
+            )
+            SELECT c.firstname, c.lastname, u.groupid, u.description, c.status, c.inserted
+            FROM c INNER JOIN usergroup u on u.groupid = c.groupid;
+        """
+        params = (chatID, *profile)
+    else:
+        sql_str = """
+            WITH c AS (
+                UPDATE chat SET firstname = %s, lastname = %s, username = %s
+                WHERE chatid = %s
+                RETURNING firstname, lastname, groupid, status
+            )
+            SELECT c.firstname, c.lastname, u.groupid, u.description, c.status, false
+            FROM c INNER JOIN usergroup u on u.groupid = c.groupid;
+        """
+        params = (*profile, chatID)
+    cur.execute(sql_str, params)
+    return cur.fetchall()
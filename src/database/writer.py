@@ -0,0 +1,124 @@
+"""
+Group commit for small, frequent writes
+
+Statements submitted by concurrently running handlers within a short
+window are executed in one transaction with one commit. Every statement
+(or function of statements) runs inside its own savepoint, so a failing
+one only fails its own caller while the others are committed.
+"""
+
+import time
+import asyncio
+import logging
+
+from .. import metrics
+from .dbinterface import DBInterface
+
+
+logger = logging.getLogger("sqlbot.database.writer")
+
+
+class GroupCommitWriter():
+    def __init__(self, db: DBInterface, window: float, max_batch: int):
+        self._db        = db
+        self._window    = window
+        self._max_batch = max_batch
+        self._batch     = []
+        self._timer     = None
+        self._flushes   = set()
+
+    def _commit(self, batch: list) -> list:
+        results = []
+        rows    = 0
+        start   = time.perf_counter()
+        try:
+            with self._db.cursor() as cur:
+                for func, args in batch:
+                    cur.execute("SAVEPOINT group_commit;")
+                    try:
+                        results.append(func(cur, *args))
+                        # of the last statement, before the savepoint resets it
+                        rows += max(cur.rowcount, 0)
+                        cur.execute("RELEASE SAVEPOINT group_commit;")
+                    except self._db.Error as err:
+                        cur.execute("ROLLBACK TO SAVEPOINT group_commit;")
+                        logger.error("Could not execute SQL-Query.", exc_info=err)
+                        metrics.db_query_errors.inc("group_commit")
+                        results.append(None)
+        except self._db.Error as err:
+            logger.error(f"Could not commit a group of {len(batch)} statements.", exc_info=err)
+            metrics.db_query_errors.inc("group_commit")
+            return [None] * len(batch)
+        finally:
+            metrics.db_query_seconds.observe(time.perf_counter() - start, "group_commit")
+        metrics.db_query_rows.inc("group_commit", amount=rows)
+        return results
+
+    async def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        try:
+            results = await asyncio.to_thread(self._commit, [(func, args) for func, args, _ in batch])
+        except Exception as err:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(err)
+            return
+        for (_, _, future), res in zip(batch, results):
+            if not future.done():
+                future.set_result(res)
+
+    def _spawn_flush(self):
+        task = asyncio.get_running_loop().create_task(self._flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    def _execute(self, cur, query, params) -> bool:
+        cur.execute(self._db.translate(query), params or ())
+        return True
+
+    async def execute(self, query, params=None) -> bool:
+        """like DBInterface.execute, committed together with concurrent writes"""
+        return await self.transaction(self._execute, query, params) is not None
+
+    async def transaction(self, func, *args):
+        """like DBInterface.transaction, committed together with concurrent writes"""
+        future = asyncio.get_running_loop().create_future()
+        self._batch.append((func, args, future))
+        if len(self._batch) >= self._max_batch:
+            self._spawn_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._window, self._spawn_flush)
+        return await future
+
+    async def close(self):
+        await self._flush()
+        if self._flushes:
+            await asyncio.wait(self._flushes)
+
+
+writer = None
+
+
+def configure(cfg, db: DBInterface):
+    global writer
+    if cfg.db_group_commit > 0:
+        writer = GroupCommitWriter(db, cfg.db_group_commit / 1000, cfg.db_group_commit_max)
+
+
+async def execute(db: DBInterface, query, params=None) -> bool:
+    """write through the group commit writer if one is configured"""
+    if writer is None:
+        return await db.execute(query, params)
+    return await writer.execute(query, params)
+
+
+async def transaction(db: DBInterface, func, *args):
+    """run func(cursor, *args) through the group commit writer if one is configured"""
+    if writer is None:
+        return await db.transaction(func, *args)
+    return await writer.transaction(func, *args)
@@ -1,9 +1,25 @@
 all = [
     'send.py',
+    'digest.py',
+    'replies.py',
     'utils.py',
-    'updater.py'
+    'updater.py',
+    'processor.py',
+    'ratelimit.py',
+    'broadcast.py',
+    'request.py',
+    'webhook.py',
+    'recorder.py'
 ]
 
 from . import send
+from . import digest
+from . import replies
 from . import utils
 from . import bot
+from . import processor
+from . import ratelimit
+from . import broadcast
+from . import request
+from . import webhook
+from . import recorder
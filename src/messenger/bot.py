@@ -1,11 +1,25 @@
+import io
+import re
+import time
+import asyncio
+import tempfile
 import logging
 
-from telegram import Update
-from telegram.error import BadRequest
-from telegram.ext import Application, ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters
-
-from . import send
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import (
+    Application, ApplicationBuilder, ApplicationHandlerStop, CallbackQueryHandler, CommandHandler, ContextTypes,
+    MessageHandler, TypeHandler, filters
+)
+
+from . import digest
+from . import inbound
+from . import replies
+from . import recorder
+from . import broadcast
 from . import utils
+from .processor import ChatOrderedUpdateProcessor
+from .request import InstrumentedRequest
+from .. import metrics
 from .. import database
 from ..configuration import Config
 from ..database.dbinterface import DBInterface
@@ -14,6 +28,63 @@ from ..database.dbinterface import DBInterface
 logger = logging.getLogger('sqlbot.updater')
 
 
+def _command_name(update: Update):
+    """command of the update, 'forward_message' for plain texts or None"""
+    if update.callback_query is not None:
+        return update.callback_query.data.split(":")[0] if update.callback_query.data else None
+    text = update.effective_message.text if update.effective_message else None
+    if not text:
+        return None
+    if not text.startswith("/"):
+        return "forward_message"
+    return text.split()[0][1:].split("@")[0].lower()
+
+
+def _forward_text(update: Update) -> str:
+    lastname = f" {update.effective_user.last_name}" if update.effective_user.last_name else ""
+    username = f" @{update.effective_user.username}" if update.effective_user.username else ""
+    return f"{update.effective_user.first_name}{lastname}{username}:\n{update.message.text}"
+
+
+def _defer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """hand a text of a user to the next moderator digest instead of forwarding it now"""
+    if digest.mod_digest is None or not update.effective_user \
+            or inbound.group_level(update.effective_chat.id) >= 2:
+        return False
+    digest.mod_digest.defer(context.bot, _forward_text(update))
+    return True
+
+
+async def gate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Runs before every handler: drops updates exceeding the chat's rate
+    limit and sheds forwarded messages during overload. Texts are deferred
+    to the moderator digest in both cases if it is enabled.
+    """
+    if not update.effective_chat:
+        return
+    chatID  = update.effective_chat.id
+    command = _command_name(update)
+    if command is None:
+        return
+
+    if inbound.overload.check() and command == "forward_message" and update.effective_user:
+        metrics.updates_shed.inc("deferred" if _defer(update, context) else "dropped")
+        raise ApplicationHandlerStop
+
+    if inbound.limiter is not None and not inbound.limiter.allow(chatID, command):
+        metrics.inbound_rejected.inc(command)
+        logger.info(f"Rate limit exceeded by chat '{chatID}' for '{command}'.")
+        if command == "forward_message" and _defer(update, context):
+            # still reaches the moderators, with the next digest
+            raise ApplicationHandlerStop
+        if update.callback_query is not None:
+            await update.callback_query.answer("Zu viele Anfragen, bitte warte kurz.")
+        elif not inbound.overload.active and inbound.limiter.notice(chatID):
+            await update.effective_message.reply_text("Zu viele Anfragen, bitte warte kurz.")
+        raise ApplicationHandlerStop
+
+
 async def start(db: DBInterface, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.effective_user:
         logger.error("/start: could not store a user.")
@@ -24,14 +95,17 @@ async def start(db: DBInterface, update: Update, context: ContextTypes.DEFAULT_T
     lastname  = update.effective_user.last_name
     username  = update.effective_user.username
 
-    if database.get.chat_known(db, chatID):
+    chat_info, inserted = await utils.touch_chat(db, update, register=True)
+    if chat_info and not inserted:
         reply = "Du hast den Start-Befehl erneut ausgeführt!"
         inlay = "erneut "
-        utils.update_chat(db, update)
-    else:
+    elif inserted:
         reply = "Willkommen beim SqlBot!\nDu wirst bald einer Gruppe zugewiesen."
         inlay = ""
-        database.insert.chat(db, chatID, firstname, lastname, username)
+    else:
+        logger.error(f"/start: could not store user with chatID '{chatID}'.")
+        await update.message.reply_text("Error during a message. Check logs!")
+        return
 
     await update.message.reply_text(reply)
 
@@ -40,13 +114,11 @@ async def start(db: DBInterface, update: Update, context: ContextTypes.DEFAULT_T
         info += f" {lastname}"
     if username:
         info += f" @{username}"
-    await send.msg_to_mods(db, context.bot, info)
+    digest.notify_mods(db, context, info, batch=False)
 
 
 async def me(db: DBInterface, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    utils.update_chat(db, update)
-
-    info = database.get.chat_info(db, update.effective_chat.id)
+    info, _ = await utils.touch_chat(db, update)
     if not info:
         logger.warning(f"Unknown user: {update.effective_chat.id}")
         await update.message.reply_text("Please issue /start command again!")
@@ -62,22 +134,13 @@ async def me(db: DBInterface, update: Update, context: ContextTypes.DEFAULT_TYPE
 
 
 async def groups(db: DBInterface, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    utils.update_chat(db, update)
-
     if not await utils.check_permissions(db, 1, update):
         return
 
-    reply  = "Es gibt folgende Nutzergruppen:\n"
-    reply += "\n".join(map(
-        lambda x: f"Gruppe {x[0]} - {x[1]}",
-        database.get.groups(db)
-    ))
-    await update.message.reply_text(reply)
+    await update.message.reply_text(await replies.groups_text(db))
 
 
 async def setstatus(db: DBInterface, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    utils.update_chat(db, update)
-
     if not await utils.check_permissions(db, 1, update):
         return
 
@@ -87,7 +150,11 @@ async def setstatus(db: DBInterface, update: Update, context: ContextTypes.DEFAU
         return
 
     chatID = update.effective_chat.id
-    if not database.update.chat_status_bad(db, chatID, " ".join(context.args)):
+    if db.sandbox.busy(chatID):
+        await update.message.reply_text("Dein letzter Status wird noch gesetzt, bitte warten.")
+        return
+
+    if not await database.update.chat_status_bad(db, chatID, " ".join(context.args)):
         logger.error(f"Something went wrong while updating status for user with id '{chatID}'")
         await update.message.reply_text("Fehler: status konnte nicht gesetzt werden.")
         return
@@ -96,10 +163,7 @@ async def setstatus(db: DBInterface, update: Update, context: ContextTypes.DEFAU
 
 
 async def help_cmd(db: DBInterface, update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
-    utils.update_chat(db, update)
-
-    chatID = update.effective_chat.id
-    chat_info = database.get.chat_info(db, chatID)
+    chat_info, _ = await utils.touch_chat(db, update)
     if not chat_info:
         logger.warning(f"Unknown user: {update.effective_chat.id}")
         await update.message.reply_text("Please issue /start command again!")
@@ -108,41 +172,174 @@ async def help_cmd(db: DBInterface, update: Update, _: ContextTypes.DEFAULT_TYPE
         logger.error(f"No groupID for the following chat: {chat_info}")
         return
 
-    reply  = "Dieser Bot dient zur Demonstration von Sicherheitslücken.\n"
-    reply += "/start - Nutzerupdate\n"
-    reply += "/me - Informationen über mich\n"
-    reply += "/groups - Gruppenübersicht\n"
-    reply += "/setstatus - Status setzen\n"
-    reply += "/help - Hilfe und Befehlsübersicht\n\n"
-    if chat_info[2] > 1:
-        reply += "/listusers - Nutzerliste\n"
-        reply += "/setusergroup - Nutzergruppe setzen\n"
-        reply += "/sendmsg - sende Nachricht an Nutzer"
+    await update.message.reply_text(replies.help_text(chat_info[2]))
 
-    await update.message.reply_text(reply)
 
+def _chat2text(chat: tuple) -> str:
+    chatid, groupid, firstname, lastname, username = chat
+    lastname = f" {lastname}" if lastname else ""
+    username = f" @{username}" if username else ""
+    return f"{firstname}{lastname}{username}\nchatID: {chatid}; groupID: {groupid}"
+
+
+async def _send_userlist(cfg: Config, db: DBInterface, bot: Bot, chatID: int, after: tuple, all_pages: bool):
+    """
+    Send the user list page by page, each page split into messages of
+    valid length and paced by the Telegram limiter. Unless all_pages is set
+    only one page is sent and a button requests the next one.
+    """
+    page_size = cfg.listusers_page_size
+    while True:
+        rows = await database.get.chats_page(db, after, page_size + 1)
+        if rows is None:
+            await bot.send_message(chat_id=chatID, text="Fehler: Nutzerliste konnte nicht geladen werden.")
+            return
+        if not rows:
+            if after is None:
+                await bot.send_message(chat_id=chatID, text="Keine Nutzer vorhanden.")
+            return
+
+        more  = len(rows) > page_size
+        rows  = rows[:page_size]
+        after = (rows[-1][1], rows[-1][0])
+        chunks = list(utils.chunk_text(map(_chat2text, rows), "\n----------\n"))
+        for i, chunk in enumerate(chunks):
+            markup = None
+            if more and not all_pages and i == len(chunks) - 1:
+                markup = InlineKeyboardMarkup([[
+                    InlineKeyboardButton("Weiter", callback_data=f"listusers:{after[0]}:{after[1]}")
+                ]])
+            await broadcast.send_paced(bot, chatID, chunk, markup)
+
+        if not more or not all_pages:
+            return
+
+
+async def listusers(cfg: Config, db: DBInterface, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await utils.check_permissions(db, 2, update):
+        return
+
+    all_pages = len(context.args) > 0 and context.args[0] == "all"
+    await _send_userlist(cfg, db, context.bot, update.effective_chat.id, None, all_pages)
 
-async def listusers(db: DBInterface, update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
-    def fetch2chat(chat: tuple):
-        chatid, groupid, firstname, lastname, username = chat
-        lastname = f" {lastname}" if lastname else ""
-        username = f" @{username}" if username else ""
-        res = f"{firstname}{lastname}{username}\nchatID: {chatid}; groupID: {groupid}"
-        return res
 
-    utils.update_chat(db, update)
+async def listusers_next(cfg: Config, db: DBInterface, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_reply_markup(reply_markup=None)
 
     if not await utils.check_permissions(db, 2, update):
         return
 
-    reply = "\n----------\n".join(map(fetch2chat, database.get.chats(db)))
-    await update.message.reply_text(reply)
+    try:
+        _, groupid, chatid = query.data.split(":")
+        after = (int(groupid), int(chatid))
+    except ValueError as ve:
+        logger.error(f"Invalid listusers callback data: '{query.data}'", exc_info=ve)
+        return
+
+    await _send_userlist(cfg, db, context.bot, update.effective_chat.id, after, False)
+
+
+_GUESTS   = ("gäste", "gaeste", "guests")
+_RANGE_RE = re.compile(r"^(-?\d+)-(-?\d+)$")
+
+# explicit chatIDs per bulk command, ranges and 'gäste' are not limited
+_MAX_BULK_IDS = 1000
 
+_SETUSERGROUP_USAGE = (
+    "Korrekter Befehl:\n/setusergroup <chatID> <groupID>\n"
+    "/setusergroup <chatID,chatID,von-bis|gäste> <groupID>"
+)
 
-async def setusergroup(db: DBInterface, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    utils.update_chat(db, update)
 
-    chat_info = database.get.chat_info(db, update.effective_chat.id)
+def _assigned_text(groupID: int) -> str:
+    info  = f"Du wurdest der Nutzergruppe {groupID} zugewiesen.\n"
+    info += "Mehr Infos durch den Befehl: /groups"
+    return info
+
+
+def _is_bulk(args: list) -> bool:
+    target = args[0].lower()
+    return len(args) > 2 or "," in target or target in _GUESTS or _RANGE_RE.match(target) is not None
+
+
+def _parse_targets(tokens: list) -> tuple:
+    """(chatIDs, ranges, guests) from tokens like '12,15', '20-30' or 'gäste'"""
+    chatIDs, ranges, guests = [], [], False
+    for token in (t for arg in tokens for t in arg.lower().split(",") if t):
+        match = _RANGE_RE.match(token)
+        if token in _GUESTS:
+            guests = True
+        elif match:
+            first, last = sorted((int(match[1]), int(match[2])))
+            ranges.append((first, last))
+        else:
+            chatIDs.append(int(token))
+    if len(chatIDs) > _MAX_BULK_IDS:
+        raise ValueError(f"more than {_MAX_BULK_IDS} chatIDs")
+    if not (chatIDs or ranges or guests):
+        raise ValueError("no chats selected")
+    return list(dict.fromkeys(chatIDs)), ranges, guests
+
+
+async def _notify_assigned(cfg: Config, bot: Bot, status, summary: str, chatIDs: list, groupID: int):
+    result = await broadcast.broadcast(bot, chatIDs, _assigned_text(groupID), concurrency=cfg.broadcast_concurrency)
+    try:
+        await status.edit_text(f"{summary}\nBenachrichtigt: {result.sent}/{result.total}")
+    except Exception as err:
+        logger.debug("Could not update the setusergroup summary.", exc_info=err)
+
+
+async def _setusergroup_bulk(cfg: Config, db: DBInterface, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                             own_groupID: int) -> None:
+    try:
+        chatIDs, ranges, guests = _parse_targets(context.args[:-1])
+        groupID = int(context.args[-1])
+    except ValueError as ve:
+        logger.info(f"Invalid setusergroup arguments: {ve}")
+        await update.message.reply_text(_SETUSERGROUP_USAGE)
+        return
+
+    if groupID not in range(4):
+        await update.message.reply_text("Ungültige groupID.")
+        return
+
+    # one query to validate, one to update all permitted chats
+    selected = 0 if guests else None
+    rows = await database.get.chat_groups(db, chatIDs, ranges, selected)
+    if rows is None:
+        await update.message.reply_text("Could not update usergroup.")
+        return
+    found     = dict(rows)
+    unknown   = [chatID for chatID in chatIDs if chatID not in found]
+    denied    = [chatID for chatID, gid in found.items() if gid >= own_groupID]
+    unchanged = sum(1 for gid in found.values() if gid == groupID and gid < own_groupID)
+
+    updated = await database.update.chats_groupID(db, groupID, own_groupID, chatIDs, ranges, selected)
+    if updated is None:
+        await update.message.reply_text("Could not update usergroup.")
+        return
+    logger.info(f"Updated usergroup to {groupID} for {len(updated)} chats.")
+
+    summary  = f"Nutzergruppe {groupID} zugewiesen: {len(updated)}\n"
+    summary += f"Unverändert: {unchanged}\n"
+    summary += f"Keine Berechtigung: {len(denied)}\n"
+    summary += f"Unbekannte chatIDs: {len(unknown)}"
+    if unknown:
+        summary += f"\nUnbekannt: {', '.join(map(str, unknown[:20]))}{' …' if len(unknown) > 20 else ''}"
+
+    status = await update.message.reply_text(summary)
+    if updated:
+        # paced by the broadcast engine in the background
+        context.application.create_task(
+            _notify_assigned(cfg, context.bot, status, summary, updated, groupID),
+            update=update
+        )
+
+
+async def setusergroup(cfg: Config, db: DBInterface, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat_info, _ = await utils.touch_chat(db, update)
     if not chat_info:
         logger.warning(f"Unknown user: {update.effective_chat.id}")
         await update.message.reply_text("Please issue /start command again!")
@@ -153,9 +350,12 @@ async def setusergroup(db: DBInterface, update: Update, context: ContextTypes.DE
         await update.message.reply_text("Du besitzt nicht die nötigen Rechte um diesen Befehl auszuführen.")
         return
 
-    if len(context.args) != 2:
-        reply = "Korrekter Befehl:\n/setusergroup <chatID> <groupID>"
-        await update.message.reply_text(reply)
+    if len(context.args) < 2:
+        await update.message.reply_text(_SETUSERGROUP_USAGE)
+        return
+
+    if _is_bulk(context.args):
+        await _setusergroup_bulk(cfg, db, update, context, own_groupID)
         return
 
     chatID, groupID = None, None
@@ -166,7 +366,7 @@ async def setusergroup(db: DBInterface, update: Update, context: ContextTypes.DE
         logger.error("Error while setting usergroup.", exc_info=ve)
         return
 
-    if not chatID or not database.get.chat_known(db, chatID):
+    if not chatID or not await database.get.chat_known(db, chatID):
         await update.message.reply_text("Ungültige chatID.")
         return
 
@@ -174,25 +374,21 @@ async def setusergroup(db: DBInterface, update: Update, context: ContextTypes.DE
         await update.message.reply_text("Ungültige groupID.")
         return
 
-    if database.get.chat_info(db, chatID)[2] >= own_groupID:
+    if (await database.get.chat_info(db, chatID))[2] >= own_groupID:
         await update.message.reply_text("Not allowed to modify groupID of a equal or higher group.")
         return
 
-    if database.update.chat_groupID(db, chatID, groupID):
+    if await database.update.chat_groupID(db, chatID, groupID):
         await update.message.reply_text("Befehl erfolgreich.")
         logger.info(f"Updated usergroup to {groupID} in chat with chatID '{chatID}'.")
 
-        info  = f"Du wurdest der Nutzergruppe {groupID} zugewiesen.\n"
-        info += "Mehr Infos durch den Befehl: /groups"
-        await context.bot.send_message(chat_id=chatID, text=info)
+        await context.bot.send_message(chat_id=chatID, text=_assigned_text(groupID))
     else:
         await update.message.reply_text("Could not update usergroup.")
         logger.error("Could not update usergroup to {groupID} in chat with chatID '{chatID}'.")
 
 
-async def sendmsg(db: DBInterface, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    utils.update_chat(db, update)
-
+async def sendmsg(cfg: Config, db: DBInterface, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not await utils.check_permissions(db, 2, update):
         return
 
@@ -202,74 +398,206 @@ async def sendmsg(db: DBInterface, update: Update, context: ContextTypes.DEFAULT
         return
 
     text  = " ".join(context.args).replace("RET ", "\n").replace("RET", "\n")
-    chats = database.get.chatids_with_groupid(db, 1)
+    chats = await database.get.chatids_with_groupid(db, 1)
 
     try:
         chats.remove(update.effective_chat.id)
     except ValueError:
         logger.error("ValueError in 'sendmsg'")
 
-    for chatID in chats:
-        try:
-            await context.bot.send_message(chat_id=chatID, text=text)
-        except BadRequest as err:
-            logmsg = f"BadRequest for user with chatid = '{chatID}'."
-            logger.error(logmsg)
-            await update.message.reply_text(logmsg)
-        except Exception as err:
-            logmsg = f"Exception for user with chatid = '{chatID}'."
-            logger.error(logmsg, exc_info=err)
-            await update.message.reply_text(logmsg)
+    # runs in the background so a long broadcast does not hold up other updates
+    status = await update.message.reply_text(f"Sende Nachricht an {len(chats)} Nutzer...")
+    context.application.create_task(
+        broadcast.broadcast(
+            context.bot, chats, text,
+            concurrency=cfg.broadcast_concurrency,
+            status=status
+        ),
+        update=update
+    )
 
-    await update.message.reply_text("Befehl ausgeführt.")
 
+async def resetdb(db: DBInterface, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await utils.check_permissions(db, 3, update):
+        return
 
-async def unknown(db: DBInterface, update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
-    utils.update_chat(db, update)
-    await update.message.reply_text("Sorry, dieser Befehl ist unbekannt. /help")
+    keep_chats = not (len(context.args) > 0 and context.args[0] == "all")
+    try:
+        restored = await asyncio.to_thread(
+            database.tables.reset_database, db, keep_chats, (update.effective_chat.id,)
+        )
+    except Exception as err:
+        logger.error("Could not reset the database.", exc_info=err)
+        await update.message.reply_text("Fehler: Datenbank konnte nicht zurückgesetzt werden.")
+        return
+    finally:
+        database.cache.clear()
+        await database.directory.reload(db)
+        await database.reference.reload(db)
 
+    await update.message.reply_text(f"Datenbank zurückgesetzt, {restored} Nutzer wiederhergestellt.")
+    digest.notify_mods(db, context, "Die Datenbank wurde zurückgesetzt.", batch=False)
 
-async def forward_message(db: DBInterface, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    utils.update_chat(db, update)
 
-    chatID    = update.effective_chat.id
-    firstname = update.effective_user.first_name
-    lastname  = update.effective_user.last_name
-    username  = update.effective_user.username
-    modids    = database.get.chatids_with_groupid(db, 2)
-
-    if chatID in modids:
+async def exportchats(db: DBInterface, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await utils.check_permissions(db, 3, update):
         return
 
-    lastname = f" {lastname}" if lastname else ""
-    username = f" @{username}" if username else ""
-    msg      = f"{firstname}{lastname}{username}:\n{update.message.text}"
+    # streamed to a temporary file, not collected in memory
+    with tempfile.TemporaryFile() as raw:
+        fp = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        try:
+            rows = await asyncio.to_thread(database.transfer.export_chats, db, fp)
+            fp.flush()
+        except Exception as err:
+            logger.error("Could not export the chat table.", exc_info=err)
+            await update.message.reply_text("Fehler: Nutzer konnten nicht exportiert werden.")
+            return
+        finally:
+            fp.detach()
+        raw.seek(0)
+        await update.message.reply_document(
+            document=raw,
+            filename=f"chats-{time.strftime('%Y%m%d-%H%M%S')}.csv",
+            caption=f"{rows} Nutzer exportiert."
+        )
+
+
+async def slowlog(db: DBInterface, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await utils.check_permissions(db, 3, update):
+        return
 
-    for chatID in modids:
-        await context.bot.send_message(chat_id=chatID, text=msg)
+    limit = 10
+    if len(context.args) > 0:
+        try:
+            limit = max(1, int(context.args[0]))
+        except ValueError:
+            await update.message.reply_text("Korrekter Befehl:\n/slowlog [anzahl]")
+            return
+
+    entries = db.slow_queries.entries(limit)
+    if not entries:
+        await update.message.reply_text("Keine langsamen Anfragen aufgezeichnet.")
+        return
+    for chunk in utils.chunk_text((entry.format() for entry in entries), "\n----------\n"):
+        await update.message.reply_text(chunk)
 
 
-async def error_handler(db: DBInterface, _: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    logger.error("Exception while handling an update:", exc_info=context.error)
-    await send.msg_to_mods(db, context.bot, "Error during a message. Check logs!")
+async def unknown(db: DBInterface, update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
+    await utils.update_chat(db, update)
+    await update.message.reply_text("Sorry, dieser Befehl ist unbekannt. /help")
 
 
-def configure_bot(cfg: Config, db: DBInterface) -> Application:
-    application = ApplicationBuilder().token(cfg.telegram_token).build()
+async def forward_message(db: DBInterface, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await utils.update_chat(db, update)
 
-    application.add_handler(CommandHandler('start',                         lambda U, c: start(db, U, c)))
-    application.add_handler(CommandHandler('me',                            lambda U, c: me(db, U, c)))
-    application.add_handler(CommandHandler('groups',                        lambda U, c: groups(db, U, c)))
-    application.add_handler(CommandHandler('setstatus',                     lambda U, c: setstatus(db, U, c)))
-    application.add_handler(CommandHandler('help',                          lambda U, c: help_cmd(db, U, c)))
+    modids = await database.get.chatids_with_groupid(db, 2)
+    if update.effective_chat.id in modids:
+        return
 
-    application.add_handler(CommandHandler('listusers',                     lambda U, c: listusers(db, U, c)))
-    application.add_handler(CommandHandler('setusergroup',                  lambda U, c: setusergroup(db, U, c)))
-    application.add_handler(CommandHandler('sendmsg',                       lambda U, c: sendmsg(db, U, c)))
+    digest.notify_mods(db, context, _forward_text(update))
 
-    application.add_handler(MessageHandler(filters.COMMAND,                 lambda U, c: unknown(db, U, c)))
 
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, lambda U, c: forward_message(db, U, c)))
+async def error_handler(db: DBInterface, _: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    logger.error("Exception while handling an update:", exc_info=context.error)
+    digest.notify_mods(db, context, "Error during a message. Check logs!")
+
+
+async def post_init(cfg: Config, db: DBInterface, application: Application) -> None:
+    if utils.profile_writer is not None:
+        utils.profile_writer.start()
+    database.listener.start(cfg, db)
+    await metrics.start(cfg)
+
+
+async def post_stop(_: Application) -> None:
+    # the last digest is sent while the bot's HTTP client is still open
+    if digest.mod_digest is not None:
+        await digest.mod_digest.stop()
+
+
+async def post_shutdown(_: Application) -> None:
+    if utils.profile_writer is not None:
+        await utils.profile_writer.stop()
+    await database.listener.stop()
+    if database.writer.writer is not None:
+        await database.writer.writer.close()
+    await metrics.stop()
+    recorder.stop()
+    logger.info(f"Cache statistics: {database.cache.stats()}")
+
+
+def register_gauges(db: DBInterface, application: Application) -> None:
+    def cache_stat(key: str):
+        return lambda: {(name,): stat[key] for name, stat in database.cache.stats().items()}
+
+    metrics.Gauge('sqlbot_update_queue_size', 'Updates waiting to be processed.',
+                  lambda: application.update_queue.qsize())
+    metrics.Gauge('sqlbot_cache_hits', 'Cache hits.', cache_stat('hits'), ('cache',))
+    metrics.Gauge('sqlbot_cache_misses', 'Cache misses.', cache_stat('misses'), ('cache',))
+    metrics.Gauge('sqlbot_cache_size', 'Cached entries.', cache_stat('size'), ('cache',))
+    metrics.Gauge('sqlbot_profile_writes_pending', 'Buffered profile updates.',
+                  lambda: len(utils.profile_writer) if utils.profile_writer is not None else 0)
+    metrics.Gauge('sqlbot_mod_digest_pending', 'Notifications waiting for the next moderator digest.',
+                  lambda: len(digest.mod_digest) if digest.mod_digest is not None else 0)
+    metrics.Gauge('sqlbot_overload', 'Overload mode active.', lambda: int(inbound.overloaded()))
+    metrics.Gauge('sqlbot_sandbox_running', 'Running sandbox statements.', db.sandbox.running)
+    metrics.Gauge('sqlbot_group_directory_size', 'Chat ids in the group directory.',
+                  lambda: {(groupID,): n for groupID, n in database.directory.groups.stats().items()}, ('group',))
+
+
+def configure_bot(cfg: Config, db: DBInterface, bot: Bot = None) -> Application:
+    """
+    Build the application with all handlers registered.
+    A prepared bot (e.g. a fake one for benchmarks) replaces the
+    Telegram connection and disables fetching updates.
+    """
+    utils.configure_profile_writer(cfg, db)
+    digest.configure_digest(cfg, db)
+    broadcast.limiter = broadcast.TelegramLimiter(cfg.telegram_rate_global, cfg.telegram_rate_chat)
+
+    if bot is None:
+        builder = ApplicationBuilder().token(cfg.telegram_token)
+        if cfg.metrics_enabled:
+            builder.request(InstrumentedRequest(connection_pool_size=256))
+        if cfg.webhook_enabled:
+            # updates arrive through the webhook receiver
+            builder.updater(None)
+    else:
+        builder = ApplicationBuilder().bot(bot).updater(None)
+    recorder.configure(cfg)
+    if recorder.recorder is not None:
+        # stamped on arrival, shed and rate limited updates are part of the load
+        builder.update_queue(recorder.RecordingQueue())
+    builder.post_init(lambda app: post_init(cfg, db, app)).post_stop(post_stop).post_shutdown(post_shutdown)
+    if cfg.concurrent_updates > 1:
+        builder.concurrent_updates(ChatOrderedUpdateProcessor(cfg.concurrent_updates))
+    application = builder.build()
+    inbound.configure(cfg, application)
+    T = metrics.timed
+
+    application.add_handler(TypeHandler(Update, T('gate', gate)), group=-1)
+
+    application.add_handler(CommandHandler('start',        T('start',        lambda U, c: start(db, U, c))))
+    application.add_handler(CommandHandler('me',           T('me',           lambda U, c: me(db, U, c))))
+    application.add_handler(CommandHandler('groups',       T('groups',       lambda U, c: groups(db, U, c))))
+    application.add_handler(CommandHandler('setstatus',    T('setstatus',    lambda U, c: setstatus(db, U, c))))
+    application.add_handler(CommandHandler('help',         T('help',         lambda U, c: help_cmd(db, U, c))))
+
+    application.add_handler(CommandHandler('listusers',    T('listusers',    lambda U, c: listusers(cfg, db, U, c))))
+    application.add_handler(CallbackQueryHandler(          T('listusers_next', lambda U, c: listusers_next(cfg, db, U, c)),
+                                                 pattern=r"^listusers:"))
+    application.add_handler(CommandHandler('setusergroup', T('setusergroup', lambda U, c: setusergroup(cfg, db, U, c))))
+    application.add_handler(CommandHandler('sendmsg',      T('sendmsg',      lambda U, c: sendmsg(cfg, db, U, c))))
+    application.add_handler(CommandHandler('resetdb',      T('resetdb',      lambda U, c: resetdb(db, U, c))))
+    application.add_handler(CommandHandler('exportchats',  T('exportchats',  lambda U, c: exportchats(db, U, c))))
+    application.add_handler(CommandHandler('slowlog',      T('slowlog',      lambda U, c: slowlog(db, U, c))))
+
+    application.add_handler(MessageHandler(filters.COMMAND, T('unknown',     lambda U, c: unknown(db, U, c))))
+
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND,
+                                           T('forward_message', lambda U, c: forward_message(db, U, c))))
     application.add_error_handler(lambda U, c: error_handler(db, U, c))
 
+    register_gauges(db, application)
     return application
@@ -0,0 +1,140 @@
+import time
+import asyncio
+import logging
+import datetime
+
+from telegram import Bot, Message
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from .ratelimit import TelegramLimiter
+
+
+logger = logging.getLogger("sqlbot.broadcast")
+
+# shared by every sender so concurrent broadcasts respect the same limits
+limiter = TelegramLimiter()
+
+
+class BroadcastResult():
+    def __init__(self, total: int):
+        self.total   = total
+        self.sent    = 0
+        self.failed  = []
+        self.retried = 0
+        self.start   = time.monotonic()
+        self.end     = None
+
+    @property
+    def done(self) -> int:
+        return self.sent + len(self.failed)
+
+    @property
+    def elapsed(self) -> float:
+        return (self.end or time.monotonic()) - self.start
+
+    def summary(self) -> str:
+        res = (
+            f"Gesendet: {self.sent}/{self.total}; fehlgeschlagen: {len(self.failed)}; "
+            f"Wiederholungen: {self.retried}; Dauer: {self.elapsed:.1f}s"
+        )
+        if self.failed:
+            shown = ", ".join(map(str, self.failed[:20]))
+            more  = f" (+{len(self.failed) - 20})" if len(self.failed) > 20 else ""
+            res  += f"\nFehlgeschlagene chatIDs: {shown}{more}"
+        return res
+
+
+def _retry_after_seconds(err: RetryAfter) -> float:
+    if isinstance(err.retry_after, datetime.timedelta):
+        return err.retry_after.total_seconds()
+    return float(err.retry_after)
+
+
+async def send_paced(bot: Bot, chatID: int, text: str, reply_markup=None, max_retries: int = 3) -> Message:
+    """
+    Send one of several messages to the same chat within the rate limits,
+    waiting out flood control. Other errors are raised.
+    """
+    for attempt in range(max_retries + 1):
+        await limiter.acquire(chatID)
+        try:
+            return await bot.send_message(chat_id=chatID, text=text, reply_markup=reply_markup)
+        except RetryAfter as err:
+            if attempt == max_retries:
+                raise
+            wait = _retry_after_seconds(err)
+            logger.warning(f"Flood control while sending to '{chatID}', retry in {wait}s.")
+            limiter.block(wait)
+
+
+async def _send(bot: Bot, chatID: int, text: str, result: BroadcastResult, max_retries: int):
+    for attempt in range(max_retries + 1):
+        await limiter.acquire(chatID)
+        try:
+            await bot.send_message(chat_id=chatID, text=text)
+            result.sent += 1
+            return
+        except RetryAfter as err:
+            wait = _retry_after_seconds(err)
+            logger.warning(f"Flood control while sending to '{chatID}', retry in {wait}s.")
+            limiter.block(wait)
+        except (BadRequest, Forbidden) as err:
+            logger.error(f"{type(err).__name__} for user with chatid = '{chatID}'.")
+            break
+        except NetworkError as err:
+            wait = 2 ** attempt
+            logger.warning(f"Network error while sending to '{chatID}', retry in {wait}s.", exc_info=err)
+            await asyncio.sleep(wait)
+        except Exception as err:
+            logger.error(f"Exception for user with chatid = '{chatID}'.", exc_info=err)
+            break
+        if attempt < max_retries:
+            result.retried += 1
+    result.failed.append(chatID)
+
+
+async def broadcast(
+    bot: Bot,
+    chatIDs: list,
+    text: str,
+    concurrency: int = 20,
+    max_retries: int = 3,
+    status: Message = None,
+    progress_interval: float = 5.0
+) -> BroadcastResult:
+    """
+    Send 'text' to all chatIDs concurrently within the Telegram rate limits.
+    If a status message is given it is edited with the progress every
+    progress_interval seconds and with the summary at the end.
+    """
+    result = BroadcastResult(len(chatIDs))
+    queue  = asyncio.Queue()
+    for chatID in chatIDs:
+        queue.put_nowait(chatID)
+
+    async def worker():
+        while not queue.empty():
+            await _send(bot, queue.get_nowait(), text, result, max_retries)
+
+    async def progress():
+        while True:
+            await asyncio.sleep(progress_interval)
+            try:
+                await status.edit_text(f"Sende Nachricht... {result.done}/{result.total}")
+            except Exception as err:
+                logger.debug("Could not update broadcast progress.", exc_info=err)
+
+    reporter = asyncio.create_task(progress()) if status is not None else None
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(chatIDs)))))
+    finally:
+        if reporter is not None:
+            reporter.cancel()
+        result.end = time.monotonic()
+
+    if status is not None:
+        logger.info(f"Broadcast finished. {result.summary()}")
+        await status.edit_text(result.summary())
+    elif result.failed:
+        logger.warning(f"Broadcast finished. {result.summary()}")
+    return result
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+
+from telegram import Bot
+from telegram.ext import ContextTypes
+
+from . import send
+from . import utils
+from ..configuration import Config
+from ..database.dbinterface import DBInterface
+
+
+logger = logging.getLogger("sqlbot.digest")
+
+
+class ModDigest():
+    """
+    Batches notifications to the moderators.
+    The first notification after a quiet window is delivered immediately,
+    further ones within the next 'window' seconds are collected and sent as
+    one digest at its end. Identical notifications are merged with a count.
+    """
+    def __init__(self, db: DBInterface, window: float):
+        self._db      = db
+        self._window  = window
+        self._pending = {}
+        self._bot     = None
+        self._task    = None
+
+    def __len__(self):
+        return sum(self._pending.values())
+
+    async def submit(self, bot: Bot, msg: str):
+        self._bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            await send.msg_to_mods(self._db, bot, msg)
+            return
+        self._pending[msg] = self._pending.get(msg, 0) + 1
+
+    def defer(self, bot: Bot, msg: str):
+        """add to the next digest without immediate delivery"""
+        self._bot = bot
+        self._pending[msg] = self._pending.get(msg, 0) + 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        entries = [msg if cnt == 1 else f"{msg}\n({cnt}x)" for msg, cnt in pending.items()]
+        header  = f"Zusammenfassung: {sum(pending.values())} Nachrichten in {self._window:g}s"
+        for chunk in utils.chunk_text([header, *entries], "\n\n"):
+            await send.msg_to_mods(self._db, self._bot, chunk)
+
+    async def _run(self):
+        try:
+            # keep batching as long as notifications keep arriving
+            while True:
+                await asyncio.sleep(self._window)
+                if not self._pending:
+                    break
+                await self.flush()
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            logger.error("Could not send the moderator digest.", exc_info=err)
+        finally:
+            self._task = None
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+
+mod_digest = None
+
+
+def configure_digest(cfg: Config, db: DBInterface):
+    global mod_digest
+    if cfg.mod_digest_window > 0:
+        mod_digest = ModDigest(db, cfg.mod_digest_window)
+
+
+def notify_mods(db: DBInterface, context: ContextTypes.DEFAULT_TYPE, msg: str, batch: bool = True):
+    """
+    msg_to_mods as a background task, so no handler waits for the rate
+    limits of the moderator chats. Batched in digests if 'mod_digest_window'
+    is set, unless batch is False.
+    """
+    if batch and mod_digest is not None:
+        coro = mod_digest.submit(context.bot, msg)
+    else:
+        coro = send.msg_to_mods(db, context.bot, msg)
+    context.application.create_task(coro)
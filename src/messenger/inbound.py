@@ -0,0 +1,117 @@
+"""
+Inbound protection: per chat rate limits for commands and load shedding
+while the backlog of pending updates is too large
+"""
+
+import time
+import logging
+
+from telegram.ext import Application
+
+from .ratelimit import TokenBucket
+from .. import database
+from ..configuration import Config
+
+
+logger = logging.getLogger("sqlbot.inbound")
+
+
+def group_level(chatID: int) -> int:
+    """only in-memory lookups, an unknown level is treated as guest"""
+    # peek, the gate must not skew the hit rate of the handlers' lookups
+    info = database.cache.chat_infos.peek(chatID)
+    if info is not None:
+        return info[2]
+    level = database.directory.groups.group_of(chatID)
+    return level if level is not None else 0
+
+
+class InboundLimiter():
+    """
+    Token bucket per (chatID, command). 'limits' maps command names to
+    (rate, burst), commands without an own entry share the 'default' bucket.
+    Rate and burst are multiplied by the factor of the caller's group level,
+    a factor of 0 exempts the group.
+    """
+    # a limited chat is told so at most once per interval (seconds)
+    NOTICE_INTERVAL = 30.0
+
+    def __init__(self, limits: dict, group_factors: dict, max_buckets: int = 50000):
+        self._limits      = {name: (float(rate), float(burst)) for name, (rate, burst) in limits.items()}
+        self._factors     = group_factors
+        self._max_buckets = max_buckets
+        self._buckets     = {}
+        self._notified    = {}
+
+    def _prune(self):
+        # buckets which are full again carry no state
+        now = time.monotonic()
+        self._buckets  = {k: b for k, b in self._buckets.items() if b.delay(b.capacity) > 0}
+        self._notified = {k: t for k, t in self._notified.items() if now - t < self.NOTICE_INTERVAL}
+
+    def notice(self, chatID: int) -> bool:
+        now = time.monotonic()
+        if now - self._notified.get(chatID, -self.NOTICE_INTERVAL) < self.NOTICE_INTERVAL:
+            return False
+        self._notified[chatID] = now
+        return True
+
+    def allow(self, chatID: int, command: str) -> bool:
+        name = command if command in self._limits else "default"
+        if name not in self._limits:
+            return True
+        factor = self._factors.get(group_level(chatID), 1)
+        if not factor:
+            return True
+
+        bucket = self._buckets.get((chatID, name))
+        if bucket is None:
+            if len(self._buckets) >= self._max_buckets:
+                self._prune()
+            rate, burst = self._limits[name]
+            bucket = self._buckets[(chatID, name)] = TokenBucket(rate * factor, burst * factor)
+        return bucket.try_acquire()
+
+
+class Overload():
+    """
+    Overload mode is entered when more than 'threshold' updates are pending
+    and left once the backlog dropped below half of it.
+    """
+    def __init__(self, application: Application, threshold: int):
+        self._application = application
+        self._threshold   = threshold
+        self.active       = False
+        self.since        = None
+
+    def backlog(self) -> int:
+        pending   = self._application.update_queue.qsize()
+        processor = self._application.update_processor
+        # updates handed to the processor wait there for a slot
+        return pending + getattr(processor, "pending", 0)
+
+    def check(self) -> bool:
+        if not self._threshold:
+            return False
+        backlog = self.backlog()
+        if not self.active and backlog > self._threshold:
+            self.active, self.since = True, time.monotonic()
+            logger.warning(f"Overload: {backlog} updates pending, shedding low priority work.")
+        elif self.active and backlog < self._threshold / 2:
+            self.active = False
+            logger.warning(f"Overload over after {time.monotonic() - self.since:.1f}s.")
+        return self.active
+
+
+limiter  = None
+overload = None
+
+
+def configure(cfg: Config, application: Application):
+    global limiter, overload
+    limiter  = InboundLimiter(cfg.rate_limits, cfg.rate_limit_group_factor) if cfg.rate_limits else None
+    overload = Overload(application, cfg.overload_backlog)
+
+
+def overloaded() -> bool:
+    return overload is not None and overload.active
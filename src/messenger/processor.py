@@ -0,0 +1,63 @@
+import asyncio
+import logging
+from typing import Any, Awaitable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+logger = logging.getLogger("sqlbot.processor")
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes up to max_concurrent_updates updates at the same time while
+    updates from the same chat are handled strictly one after another in
+    the order they were received.
+    """
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}
+        self._waiting = {}
+        self._total = 0
+
+    @property
+    def pending(self) -> int:
+        """updates received but not yet being handled"""
+        return max(0, self._total - self.current_concurrent_updates)
+
+    @staticmethod
+    def _chat_key(update: object):
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        chatID = self._chat_key(update)
+        if chatID is None:
+            await super().process_update(update, coroutine)
+            return
+
+        # Take the per chat lock before a global slot, so queued updates of
+        # one busy chat do not occupy slots other chats could use.
+        lock = self._locks.setdefault(chatID, asyncio.Lock())
+        self._waiting[chatID] = self._waiting.get(chatID, 0) + 1
+        self._total += 1
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            self._total -= 1
+            self._waiting[chatID] -= 1
+            if not self._waiting[chatID]:
+                del self._waiting[chatID]
+                del self._locks[chatID]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
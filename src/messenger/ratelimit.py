@@ -0,0 +1,83 @@
+import time
+import asyncio
+
+
+class TokenBucket():
+    """
+    Classic token bucket: 'rate' tokens per second are added up to
+    'capacity', every acquired token allows one action.
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate      = rate
+        self.capacity  = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens   = self.capacity
+        self._last     = time.monotonic()
+        self._blocked  = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last   = now
+
+    def delay(self, n: float = 1.0) -> float:
+        """seconds until n tokens are available"""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self._blocked - now)
+        if self._tokens < n:
+            wait = max(wait, (n - self._tokens) / self.rate)
+        return wait
+
+    def try_acquire(self, n: float = 1.0) -> bool:
+        if self.delay(n) > 0:
+            return False
+        self._tokens -= n
+        return True
+
+    async def acquire(self, n: float = 1.0):
+        while not self.try_acquire(n):
+            await asyncio.sleep(self.delay(n))
+
+    def block(self, seconds: float):
+        """refuse all tokens for the given time, e.g. after a flood warning"""
+        self._blocked = max(self._blocked, time.monotonic() + seconds)
+
+
+class TelegramLimiter():
+    """
+    Outgoing message limits of the bot API:
+    a global rate for the whole bot and a lower rate per single chat.
+    """
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, max_chats: int = 10000):
+        self.global_bucket = TokenBucket(global_rate)
+        self._chat_rate    = chat_rate
+        self._max_chats    = max_chats
+        self._chats        = {}
+
+    def _chat_bucket(self, chatID: int) -> TokenBucket:
+        bucket = self._chats.get(chatID)
+        if bucket is None:
+            if len(self._chats) >= self._max_chats:
+                # drop buckets which are full again, they carry no state
+                now = time.monotonic()
+                self._chats = {
+                    k: b for k, b in self._chats.items()
+                    if b.delay(b.capacity) > 0 or b._blocked > now
+                }
+            bucket = self._chats[chatID] = TokenBucket(self._chat_rate, 1.0)
+        return bucket
+
+    async def acquire(self, chatID: int):
+        chat_bucket = self._chat_bucket(chatID)
+        while True:
+            wait = max(chat_bucket.delay(), self.global_bucket.delay())
+            if wait <= 0:
+                chat_bucket.try_acquire()
+                self.global_bucket.try_acquire()
+                return
+            await asyncio.sleep(wait)
+
+    def block(self, seconds: float, chatID: int = None):
+        if chatID is None:
+            self.global_bucket.block(seconds)
+        else:
+            self._chat_bucket(chatID).block(seconds)
@@ -0,0 +1,79 @@
+"""
+Records incoming updates with their arrival time to an append-only
+JSON lines file, one {"t": unix time, "u": update} object per line.
+Updates are stamped when polling or the webhook put them on the update
+queue, before any waiting for a processing slot.
+Recordings are fed back through the handlers by src.benchmark.replay.
+"""
+
+import json
+import time
+import asyncio
+import logging
+
+from telegram import Update
+
+from ..configuration import Config
+
+
+logger = logging.getLogger("sqlbot.recorder")
+
+
+class UpdateRecorder():
+    """
+    Lines are buffered and written at most 'flush_interval' seconds after
+    the update arrived, so recording costs no disk access per update.
+    """
+    def __init__(self, path: str, flush_interval: float = 1.0):
+        self.path            = path
+        self.recorded        = 0
+        self._flush_interval = flush_interval
+        self._fp             = open(path, "a", encoding="UTF-8")
+        self._timer          = None
+
+    def record(self, update: Update):
+        line = json.dumps({"t": round(time.time(), 3), "u": update.to_dict()},
+                          separators=(",", ":"), ensure_ascii=False)
+        self._fp.write(line + "\n")
+        self.recorded += 1
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._flush_interval, self.flush)
+
+    def flush(self):
+        self._timer = None
+        try:
+            self._fp.flush()
+        except OSError as err:
+            logger.error(f"Could not write the update recording '{self.path}'.", exc_info=err)
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self.flush()
+        self._fp.close()
+        logger.info(f"Recorded {self.recorded} updates to '{self.path}'.")
+
+
+class RecordingQueue(asyncio.Queue):
+    """update queue recording every update put on it"""
+    def put_nowait(self, item):
+        if recorder is not None and isinstance(item, Update):
+            recorder.record(item)
+        super().put_nowait(item)
+
+
+recorder = None
+
+
+def configure(cfg: Config):
+    global recorder
+    if cfg.record_updates:
+        recorder = UpdateRecorder(cfg.record_updates)
+        logger.warning(f"Recording all incoming updates to '{cfg.record_updates}'.")
+
+
+def stop():
+    global recorder
+    if recorder is not None:
+        recorder.close()
+        recorder = None
@@ -0,0 +1,53 @@
+"""
+Precomputed replies which only depend on the caller's group level or on
+reference data
+"""
+
+from .. import database
+from ..database.dbinterface import DBInterface
+
+
+def _render_help(level: int) -> str:
+    reply  = "Dieser Bot dient zur Demonstration von Sicherheitslücken.\n"
+    reply += "/start - Nutzerupdate\n"
+    reply += "/me - Informationen über mich\n"
+    reply += "/groups - Gruppenübersicht\n"
+    reply += "/setstatus - Status setzen\n"
+    reply += "/help - Hilfe und Befehlsübersicht\n\n"
+    if level > 1:
+        reply += "/listusers [all] - Nutzerliste\n"
+        reply += "/setusergroup - Nutzergruppe setzen (auch Listen, von-bis, gäste)\n"
+        reply += "/sendmsg - sende Nachricht an Nutzer"
+    if level > 2:
+        reply += "\n/resetdb [all] - Datenbank zurücksetzen"
+        reply += "\n/exportchats - Nutzer als CSV exportieren"
+        reply += "\n/slowlog [anzahl] - langsame Datenbankanfragen"
+    return reply
+
+
+# groupID -> /help reply, the usergroup table allows groupIDs 0 to 5
+HELP = {level: _render_help(level) for level in range(6)}
+
+
+def help_text(level: int) -> str:
+    return HELP.get(level) or _render_help(level)
+
+
+def _render_groups(rows) -> str:
+    reply  = "Es gibt folgende Nutzergruppen:\n"
+    reply += "\n".join(f"Gruppe {row[0]} - {row[1]}" for row in rows)
+    return reply
+
+
+# (reference version, rendered /groups reply)
+_groups = (None, None)
+
+
+async def groups_text(db: DBInterface) -> str:
+    global _groups
+    if database.reference.usergroups is None:
+        return _render_groups(await database.get.groups(db))
+    version = database.reference.version
+    if _groups[0] != version:
+        _groups = (version, _render_groups(database.reference.usergroups))
+    return _groups[1]
@@ -0,0 +1,15 @@
+import time
+
+from telegram.request import HTTPXRequest
+
+from .. import metrics
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest recording the latency of every bot API call"""
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            metrics.telegram_seconds.observe(time.perf_counter() - start, url.rsplit("/", 1)[-1])
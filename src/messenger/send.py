@@ -2,6 +2,7 @@ import logging
 
 from telegram import Bot
 
+from . import broadcast
 from .. import database
 from ..database.dbinterface import DBInterface
 
@@ -9,8 +10,12 @@ from ..database.dbinterface import DBInterface
 logger = logging.getLogger("sqlbot.send")
 
 
-async def msg_to_mods(db: DBInterface, bot: Bot, msg: str) -> None:
-    modids = database.get.chatids_with_groupid(db, 2)
-    for chatID in modids:
-        await bot.send_message(chat_id=chatID, text=msg)
+async def msg_to_chats(bot: Bot, chatIDs: list, msg: str) -> None:
+    """send concurrently within the rate limits, failures are logged by the broadcast"""
+    if chatIDs:
+        await broadcast.broadcast(bot, chatIDs, msg, max_retries=1)
+
 
+async def msg_to_mods(db: DBInterface, bot: Bot, msg: str) -> None:
+    modids = await database.get.chatids_with_groupid(db, 2)
+    await msg_to_chats(bot, modids, msg)
@@ -1,20 +1,160 @@
+import asyncio
+import logging
+
 from telegram import Update
 
+from . import inbound
 from .. import database
+from ..configuration import Config
 from ..database.dbinterface import DBInterface
 
 
+logger = logging.getLogger("sqlbot.utils")
+
+# maximum length of a Telegram text message
+MAX_MESSAGE_LENGTH = 4096
+
+
+class ProfileWriter():
+    """
+    Write-behind buffer for profile updates.
+    Changed profiles are collected and written with one batched
+    statement every 'interval' seconds, later changes of the same chat
+    replace earlier pending ones.
+    """
+    def __init__(self, db: DBInterface, interval: float):
+        self._db       = db
+        self._interval = interval
+        self._pending  = {}
+        self._task     = None
+
+    def submit(self, chatID: int, profile: tuple):
+        self._pending[chatID] = profile
+
+    def pending(self, chatID: int):
+        return self._pending.get(chatID)
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def flush(self) -> bool:
+        if not self._pending:
+            return True
+        batch, self._pending = self._pending, {}
+        rows = [(chatID, *profile) for chatID, profile in batch.items()]
+        if await database.update.chats(self._db, rows):
+            logger.debug(f"Flushed {len(rows)} profile updates.")
+            return True
+        # keep the failed profiles unless they were superseded meanwhile
+        for chatID, profile in batch.items():
+            self._pending.setdefault(chatID, profile)
+        logger.error(f"Could not flush {len(rows)} profile updates.")
+        return False
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+profile_writer = None
+
+
+def configure_profile_writer(cfg: Config, db: DBInterface):
+    global profile_writer
+    if cfg.profile_write_behind > 0:
+        profile_writer = ProfileWriter(db, cfg.profile_write_behind)
+
+
+async def touch_chat(db: DBInterface, update: Update, register: bool = False):
+    """
+    Command prologue: store the profile if it changed and return
+    (chat_info, inserted). Answered from the caches without a database
+    round trip when the profile is unchanged and the chat_info is cached.
+    """
+    chatID    = update.effective_chat.id
+    firstname = update.effective_user.first_name
+    lastname  = update.effective_user.last_name
+    username  = update.effective_user.username
+    profile   = (firstname, lastname, username)
+
+    info = database.cache.chat_infos.get(chatID, database.cache.MISSING)
+    if info is not database.cache.MISSING and info is not None:
+        if profile_writer is not None and profile_writer.pending(chatID) is not None:
+            profile_writer.submit(chatID, profile)
+            return (firstname, lastname, *info[2:]), False
+        if database.cache.profiles.get(chatID) == profile:
+            return info, False
+        if profile_writer is not None:
+            profile_writer.submit(chatID, profile)
+            return (firstname, lastname, *info[2:]), False
+        if inbound.overloaded():
+            # the profile is written with a later update
+            return (firstname, lastname, *info[2:]), False
+
+    if info is None and not register:
+        # known to be unregistered, nothing to store
+        return None, False
+    return await database.update.chat_touch(db, chatID, firstname, lastname, username, register)
+
+
 async def check_permissions(db: DBInterface, groupID: int, update: Update) -> bool:
-    chat_info = database.get.chat_info(db, update.effective_chat.id)
+    chat_info, _ = await touch_chat(db, update)
     if not chat_info or chat_info[2] < groupID:
-        await update.message.reply_text("Du besitzt nicht die nötigen Rechte um diesen Befehl auszuführen.")
+        await update.effective_message.reply_text("Du besitzt nicht die nötigen Rechte um diesen Befehl auszuführen.")
         return False
     return True
 
 
-def update_chat(db: DBInterface, update: Update) -> bool:
+async def update_chat(db: DBInterface, update: Update) -> bool:
     chatID    = update.effective_chat.id
     firstname = update.effective_user.first_name
     lastname  = update.effective_user.last_name
     username  = update.effective_user.username
-    return database.update.chat(db, chatID, firstname, lastname, username)
+    profile   = (firstname, lastname, username)
+
+    if profile_writer is not None and profile_writer.pending(chatID) is not None:
+        profile_writer.submit(chatID, profile)
+        return True
+    if database.cache.profiles.get(chatID) == profile:
+        return True
+    if profile_writer is not None:
+        profile_writer.submit(chatID, profile)
+        return True
+    if inbound.overloaded():
+        return True
+    return await database.update.chat(db, chatID, firstname, lastname, username)
+
+
+def chunk_text(entries, sep: str = "\n", limit: int = MAX_MESSAGE_LENGTH):
+    """
+    Join entries with sep into as few messages as possible,
+    none of them longer than limit. Overlong entries are truncated.
+    """
+    chunk = ""
+    for entry in entries:
+        if len(entry) > limit:
+            entry = entry[:limit - 1] + "…"
+        if not chunk:
+            chunk = entry
+        elif len(chunk) + len(sep) + len(entry) <= limit:
+            chunk += sep + entry
+        else:
+            yield chunk
+            chunk = entry
+    if chunk:
+        yield chunk
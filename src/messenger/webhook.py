@@ -0,0 +1,191 @@
+"""
+Webhook mode: updates are received by a small local HTTP server instead of
+being fetched by long polling
+
+Telegram (or a reverse proxy / load balancer in front of several bots)
+POSTs each update as JSON to 'webhook_path'. Requests have to carry the
+configured secret in the X-Telegram-Bot-Api-Secret-Token header. Accepted
+updates are put on the update queue of the application and answered right
+away, the handlers run afterwards.
+"""
+
+import hmac
+import json
+import signal
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import Application
+
+from .. import metrics
+from ..configuration import Config
+
+
+logger = logging.getLogger('sqlbot.webhook')
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+# Telegram updates are a few kilobytes, anything larger is not an update
+MAX_BODY_SIZE = 1 << 20
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable"
+}
+
+
+class WebhookReceiver():
+    """
+    HTTP/1.1 server accepting updates on a single path.
+    At most 'webhook_max_connections' connections are served at once,
+    further connections are answered with 503.
+    """
+    def __init__(self, cfg: Config, application: Application):
+        self._application = application
+        self._host        = cfg.webhook_listen
+        self._port        = cfg.webhook_port
+        self._path        = cfg.webhook_path
+        self._secret      = cfg.webhook_secret.encode() if cfg.webhook_secret else None
+        self._max_conns   = cfg.webhook_max_connections
+        self._conns       = 0
+        self._server      = None
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader):
+        """(method, path, headers, body) or None if the client closed the connection"""
+        line = await asyncio.wait_for(reader.readline(), 30.0)
+        if not line:
+            return None
+        parts = line.decode('latin-1').split()
+        if len(parts) != 3:
+            raise ValueError("malformed request line")
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), 5.0)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, val = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = val.strip()
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY_SIZE:
+            return parts[0], parts[1], headers, None
+        body = await asyncio.wait_for(reader.readexactly(length), 5.0) if length else b""
+        return parts[0], parts[1], headers, body
+
+    async def _dispatch(self, method: str, path: str, headers: dict, body: bytes) -> int:
+        if path.split("?")[0] != self._path:
+            return 404
+        if method != "POST":
+            return 405
+        if self._secret is not None and \
+                not hmac.compare_digest(headers.get(SECRET_HEADER, "").encode(), self._secret):
+            return 403
+        if body is None:
+            return 413
+        try:
+            data = json.loads(body)
+            if not isinstance(data, dict):
+                raise TypeError(f"expected an object, got {type(data).__name__}")
+            update = Update.de_json(data, self._application.bot)
+        # nested values of the wrong type surface as AttributeError in de_json
+        except (ValueError, TypeError, KeyError, AttributeError) as err:
+            logger.warning(f"Received an invalid update: {err}")
+            return 400
+        if update is None:
+            return 400
+        await self._application.update_queue.put(update)
+        return 200
+
+    @staticmethod
+    def _respond(writer: asyncio.StreamWriter, status: int, keep_alive: bool):
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+            "Content-Length: 0\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+        )
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if self._conns >= self._max_conns:
+            metrics.webhook_requests.inc("503")
+            self._respond(writer, 503, False)
+            writer.close()
+            return
+
+        self._conns += 1
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status     = await self._dispatch(method, path, headers, body)
+                keep_alive = headers.get("connection", "").lower() != "close" and body is not None
+                metrics.webhook_requests.inc(str(status))
+                self._respond(writer, status, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._conns -= 1
+            writer.close()
+
+    def connections(self) -> int:
+        return self._conns
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self._host, self._port)
+        logger.info(f"Webhook receiver listening on http://{self._host}:{self._port}{self._path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+async def _run(cfg: Config, application: Application):
+    receiver = WebhookReceiver(cfg, application)
+    metrics.Gauge('sqlbot_webhook_connections', 'Open webhook connections.', receiver.connections)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    # same lifecycle as Application.run_polling, which calls the hooks itself
+    await application.initialize()
+    try:
+        if application.post_init is not None:
+            await application.post_init(application)
+        await application.start()
+        await receiver.start()
+        if cfg.webhook_url:
+            await application.bot.set_webhook(
+                url=cfg.webhook_url,
+                secret_token=cfg.webhook_secret,
+                max_connections=cfg.webhook_max_connections,
+                allowed_updates=Update.ALL_TYPES
+            )
+            logger.info(f"Webhook registered at {cfg.webhook_url}")
+        await stop.wait()
+    finally:
+        await receiver.stop()
+        if application.running:
+            await application.stop()
+        if application.post_stop is not None:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown is not None:
+            await application.post_shutdown(application)
+
+
+def run_webhook(cfg: Config, application: Application):
+    """
+    Serve updates received by the local webhook receiver until SIGINT/SIGTERM.
+    The webhook is only registered at Telegram if 'webhook_url' is set,
+    otherwise the receiver is expected to be fed by a proxy or the test sender.
+    """
+    asyncio.run(_run(cfg, application))
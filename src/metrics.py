@@ -0,0 +1,254 @@
+"""
+This module provides lightweight in-process instrumentation
+
+Counters and histograms are collected while 'metrics_enabled' is set and
+exposed in the Prometheus text format by a small HTTP endpoint.
+A summary is written to the log periodically.
+"""
+
+import re
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+
+from telegram.ext import ApplicationHandlerStop
+
+
+logger = logging.getLogger('sqlbot.metrics')
+
+enabled = False
+
+# name of the handler the current task is running, used to attribute queries
+current_handler = contextvars.ContextVar('current_handler', default=None)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_lock     = threading.Lock()
+
+
+def _escape(val) -> str:
+    return str(val).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labelstr(labelnames: tuple, labels: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter():
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name       = name
+        self.help       = help
+        self.labelnames = labelnames
+        self.values     = {}
+        _registry.append(self)
+
+    def inc(self, *labels, amount: float = 1.0):
+        if not enabled:
+            return
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, val in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labelstr(self.labelnames, labels)} {val}")
+        return lines
+
+
+class Histogram():
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name       = name
+        self.help       = help
+        self.labelnames = labelnames
+        self.buckets    = buckets
+        # labels -> [bucket counts..., sum, count]
+        self.values     = {}
+        _registry.append(self)
+
+    def observe(self, value: float, *labels):
+        if not enabled:
+            return
+        with _lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def quantile(self, q: float, *labels) -> float:
+        """upper bound of the bucket containing the q-quantile"""
+        entry = self.values.get(labels)
+        if not entry or not entry[-1]:
+            return 0.0
+        for i, bound in enumerate(self.buckets):
+            if entry[i] >= q * entry[-1]:
+                return bound
+        return float("inf")
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, entry in sorted(self.values.items()):
+            for bound, cnt in zip(self.buckets, entry):
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labelstr(self.labelnames, labels, le)} {cnt}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labelstr(self.labelnames, labels, le)} {entry[-1]}")
+            lines.append(f"{self.name}_sum{_labelstr(self.labelnames, labels)} {entry[-2]}")
+            lines.append(f"{self.name}_count{_labelstr(self.labelnames, labels)} {entry[-1]}")
+        return lines
+
+
+class Gauge():
+    """value is computed on collection: callback returns a number or a dict labels -> number"""
+    def __init__(self, name: str, help: str, callback, labelnames: tuple = ()):
+        self.name       = name
+        self.help       = help
+        self.callback   = callback
+        self.labelnames = labelnames
+        _registry.append(self)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.callback()
+        except Exception as err:
+            logger.debug(f"Could not collect gauge '{self.name}'.", exc_info=err)
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, val in sorted(values.items()):
+            lines.append(f"{self.name}{_labelstr(self.labelnames, labels)} {val}")
+        return lines
+
+
+handler_seconds  = Histogram('sqlbot_handler_seconds', 'Latency of update handlers.', ('handler',))
+handler_errors   = Counter('sqlbot_handler_errors_total', 'Exceptions raised by update handlers.', ('handler',))
+db_query_seconds = Histogram('sqlbot_db_query_seconds', 'Latency of SQL statements.', ('query',))
+db_query_rows    = Counter('sqlbot_db_query_rows_total', 'Rows returned or affected by SQL statements.', ('query',))
+db_query_errors  = Counter('sqlbot_db_query_errors_total', 'Failed SQL statements.', ('query',))
+telegram_seconds = Histogram('sqlbot_telegram_request_seconds', 'Latency of Telegram bot API calls.', ('method',))
+inbound_rejected = Counter('sqlbot_inbound_rejected_total', 'Updates rejected by the per chat rate limits.', ('command',))
+updates_shed     = Counter('sqlbot_updates_shed_total', 'Low priority updates shed or deferred during overload.', ('action',))
+webhook_requests = Counter('sqlbot_webhook_requests_total', 'Webhook requests by response status.', ('status',))
+
+
+_ws_re     = re.compile(r"\s+")
+_values_re = re.compile(r"(\([^()]*%s[^()]*\)(,\s*)?){2,}")
+
+
+def query_label(query) -> str:
+    """bounded label for an SQL statement: normalized text without repeated value lists"""
+    if not isinstance(query, str):
+        query = str(query)
+    query = _values_re.sub("(...) ", _ws_re.sub(" ", query).strip())
+    return query[:120]
+
+
+def render() -> str:
+    with _lock:
+        lines = [line for metric in _registry for line in metric.render()]
+    return "\n".join(lines) + "\n"
+
+
+def summary() -> str:
+    parts = []
+    with _lock:
+        for labels, entry in sorted(handler_seconds.values.items()):
+            if entry[-1]:
+                parts.append(
+                    f"{labels[0]}: n={entry[-1]} avg={entry[-2] / entry[-1] * 1000:.1f}ms "
+                    f"p99<={handler_seconds.quantile(0.99, *labels) * 1000:.0f}ms"
+                )
+        queries = sum(entry[-1] for entry in db_query_seconds.values.values())
+        qtime   = sum(entry[-2] for entry in db_query_seconds.values.values())
+        calls   = sum(entry[-1] for entry in telegram_seconds.values.values())
+    parts.append(f"db: n={queries} total={qtime:.2f}s")
+    parts.append(f"telegram: n={calls}")
+    return "; ".join(parts)
+
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await asyncio.wait_for(reader.readline(), 5.0)
+        while True:
+            line = await asyncio.wait_for(reader.readline(), 5.0)
+            if line in (b"\r\n", b"\n", b""):
+                break
+        parts = request.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _log_summary(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"Metrics summary: {summary()}")
+
+
+_server = None
+_logtask = None
+
+
+async def start(cfg):
+    global enabled, _server, _logtask
+    enabled = bool(cfg.metrics_enabled)
+    if not enabled:
+        return
+    _server = await asyncio.start_server(_serve, cfg.metrics_host, cfg.metrics_port)
+    logger.info(f"Metrics endpoint listening on http://{cfg.metrics_host}:{cfg.metrics_port}/metrics")
+    if cfg.metrics_log_interval > 0:
+        _logtask = asyncio.create_task(_log_summary(cfg.metrics_log_interval))
+
+
+async def stop():
+    global _server, _logtask
+    if _logtask is not None:
+        _logtask.cancel()
+        _logtask = None
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
+    if enabled:
+        logger.info(f"Metrics summary: {summary()}")
+
+
+def timed(name: str, callback):
+    """wrap an update handler callback to record its latency and errors"""
+    async def wrapper(update, context):
+        token = current_handler.set(name)
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            # ends the handling on purpose, e.g. a rate limited update
+            raise
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, name)
+            current_handler.reset(token)
+    return wrapper
@@ -31,17 +31,48 @@ def configure_logging(cfg):
 
 
 def configure_db(cfg):
-    db = database.dbinterface.DBInterface(cfg)
+    db = database.dbinterface.create(cfg)
+    database.cache.configure(cfg)
+    database.writer.configure(cfg, db)
 
     if cfg.db_init:
         database.tables.initialize_database(db)
         logger.warning("Please set 'db_init: false' in your config and restart.")
         sys.exit(0)
 
-    database.tables.check_table_existance(db)
+    try:
+        version = database.tables.migrate(db)
+    except Exception as err:
+        logger.critical("Could not migrate the database schema.", exc_info=err)
+        db.close()
+        sys.exit(1)
+    logger.info(f"Database schema at version {version}.")
+    database.tables.capture_snapshot(db)
+    database.directory.load(db)
+    database.reference.load(db)
     return db
 
 
+def transfer_chats(cfg, db):
+    """
+    run the CSV export or import of the chat table given on the command line
+    """
+
+    try:
+        if cfg.export_chats:
+            with open(cfg.export_chats, 'w', encoding='UTF-8', newline='') as fp:
+                rows = database.transfer.export_chats(db, fp)
+            logger.info(f"Exported {rows} chats to '{cfg.export_chats}'.")
+        else:
+            with open(cfg.import_chats, 'r', encoding='UTF-8', newline='') as fp:
+                rows = database.transfer.import_chats(db, fp)
+            logger.info(f"Imported {rows} chats from '{cfg.import_chats}'.")
+    except (OSError, ValueError, db.Error) as err:
+        logger.critical("Could not transfer the chat table.", exc_info=err)
+        db.close()
+        sys.exit(1)
+
+
 def launch():
     """
     Read configuration, setup logging module,
@@ -54,8 +85,16 @@ def launch():
     configure_logging(cfg)
     db = configure_db(cfg)
 
+    if cfg.export_chats or cfg.import_chats:
+        transfer_chats(cfg, db)
+        db.close()
+        return
+
     application = messenger.bot.configure_bot(cfg, db)
-    application.run_polling()
+    if cfg.webhook_enabled:
+        messenger.webhook.run_webhook(cfg, application)
+    else:
+        application.run_polling()
 
     db.close()
     logger.info("Shutting down")
@@ -0,0 +1,42 @@
+from src.database.cache import TTLCache
+
+
+def test_fills_of_different_keys_do_not_invalidate_each_other():
+    c  = TTLCache(10, 60.0)
+    v1 = c.version(1)
+    v2 = c.version(2)
+    # another chat is touched and updated while both fills are in flight
+    c.replace(3, "row3", c.version(3))
+    c.pop(4)
+    assert c.put(1, "row1", v1)
+    assert c.replace(2, "row2", v2)
+    assert c.get(1) == "row1" and c.get(2) == "row2"
+
+
+def test_fill_of_an_invalidated_key_is_dropped():
+    c = TTLCache(10, 60.0)
+    v = c.version(1)
+    c.pop(1)
+    assert not c.put(1, "stale", v)
+    assert c.get(1) is None
+
+
+def test_write_drops_fills_read_before_it():
+    c      = TTLCache(10, 60.0)
+    reader = c.version(1)
+    c.replace(1, "written", c.version(1))
+    assert not c.put(1, "read before the write", reader)
+    assert c.get(1) == "written"
+
+
+def test_clear_and_pruning_invalidate_pending_fills():
+    c = TTLCache(2, 60.0)
+    v = c.version(1)
+    c.clear()
+    assert not c.put(1, "stale", v)
+
+    v = c.version(1)
+    for key in range(10, 20):
+        c.pop(key)
+    assert not c.put(1, "stale", v)
+    assert c.put(1, "fresh", c.version(1))
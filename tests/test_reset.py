@@ -0,0 +1,39 @@
+import asyncio
+
+from src import configuration
+from src import database
+from src.database import tables, update
+
+
+def _db(tmp_path):
+    path = tmp_path / "config.yaml"
+    path.write_text('telegram_token: "123456:fake"\ndb_backend: sqlite\ndb_path: ":memory:"\n')
+    cfg = configuration.getcfg(str(path))
+    configuration.check_cfg(cfg)
+    db = database.dbinterface.create(cfg)
+    database.cache.configure(cfg)
+    database.writer.configure(cfg, db)
+    tables.migrate(db)
+    tables.reset_database(db, False)
+    return db
+
+
+def test_reset_undoes_injected_rows_and_keeps_own_writes(tmp_path):
+    db = _db(tmp_path)
+
+    async def scenario():
+        await update.chat_touch(db, 10, "Anna", None, "anna", register=True)
+        await update.chat_touch(db, 11, "Ben", None, None, register=True)
+        await update.chat_groupID(db, 11, 2)
+        await update.chat_touch(db, 10, "Anna", "Neu", "anna")
+        # escalates the own group and inserts a fake admin
+        await update.chat_status_bad(db, 10, "x', groupid = 3 WHERE chatid = 10; "
+                                             "INSERT INTO chat (chatid, groupid, firstname) VALUES (99, 3, 'x'); --")
+
+    try:
+        asyncio.run(scenario())
+        assert tables.reset_database(db) == 2
+        rows = db.fetch_sync("SELECT chatid, groupid, firstname, lastname, status FROM chat ORDER BY chatid;")
+        assert [tuple(row) for row in rows] == [(10, 0, "Anna", "Neu", None), (11, 2, "Ben", None, None)]
+    finally:
+        db.close()